@@ -0,0 +1,275 @@
+from re import search as match
+from sys import stdout, stderr
+from json import dumps
+from shlex import split
+from pathlib import Path
+from contextlib import redirect_stdout
+from classes import AddressBook, NoteBook, Record, Name, Phone, Email
+from classes import Birthday
+
+# script grammar (one command per line, shell-like quoting,
+# lines starting with '#' are comments):
+#   add-contact NAME [birthday=yyyy-mm-dd] [email=E] [phone=P]...
+#   add-phone NAME PHONE...
+#   del-phone NAME PHONE
+#   set-email NAME EMAIL
+#   set-birthday NAME yyyy-mm-dd
+#   delete-contact NAME
+#   add-note TEXT [#tag]...
+#   tag NOTE_ID #tag...
+#   untag NOTE_ID #tag
+#   update-note NOTE_ID TEXT
+#   delete-note NOTE_ID
+#   search contacts|name|phone|email|birthday|notes|text|tag QUERY
+#   owner PHONE|EMAIL
+#   duplicates
+#   export vcard|csv|markdown|jsonl FILE [SCOPE [QUERY]]
+#   sort [FOLDER] [dry-run]
+#   save
+# every command prints one JSON line: {"line", "command", "ok", "result"}
+# or {"line", "command", "ok", "error"}
+
+# search scopes giving note ids, the others give contact names
+NOTE_SCOPES = ("notes", "text", "tag")
+
+
+def parse_options(args: list[str]) -> tuple[list, dict]:
+    positional = []
+    options: dict = {}
+    for arg in args:
+        key, sep, value = arg.partition("=")
+        if sep and key in ("birthday", "email", "phone"):
+            options.setdefault(key, []).append(value)
+        else:
+            positional.append(arg)
+    return positional, options
+
+
+def expect(args: list, count: int, usage: str):
+    if len(args) < count:
+        raise ValueError(f"usage: {usage}")
+
+
+def get_record(contacts: AddressBook, name: str) -> Record:
+    if name not in contacts:
+        raise KeyError(f"'{name}' is not in Contact list")
+    return contacts[name]
+
+
+def get_note_id(notes: NoteBook, value: str) -> int:
+    if not value.isdigit() or int(value) not in notes:
+        raise KeyError(f"Note '{value}' does not exist")
+    return int(value)
+
+
+def add_contact(args, contacts: AddressBook, notes: NoteBook):
+    positional, options = parse_options(args)
+    expect(positional, 1, "add-contact NAME [birthday=] [email=] [phone=]")
+    record = Record(
+        Name(positional[0]),
+        birthday=Birthday(options["birthday"][-1])
+        if "birthday" in options else None,
+        email=Email(options["email"][-1]) if "email" in options else None,
+        phone=[Phone(p) for p in options.get("phone", [])],
+    )
+    contacts.add_record(record, print_msg=False)
+    return record.name.value
+
+
+def add_phone(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "add-phone NAME PHONE...")
+    phones = [Phone(p) for p in args[1:]]
+    added = get_record(contacts, args[0]).add_phone(phones)
+    if added:
+        contacts.save_changes = True
+    return added
+
+
+def del_phone(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "del-phone NAME PHONE")
+    record = get_record(contacts, args[0])
+    for phone in record.phone:
+        if phone.value == args[1]:
+            record.del_phone(phone)
+            contacts.save_changes = True
+            return True
+    raise KeyError(f"'{args[0]}' has no phone '{args[1]}'")
+
+
+def set_email(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "set-email NAME EMAIL")
+    get_record(contacts, args[0]).email = Email(args[1])
+    contacts.save_changes = True
+
+
+def set_birthday(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "set-birthday NAME yyyy-mm-dd")
+    get_record(contacts, args[0]).birthday = Birthday(args[1])
+    contacts.save_changes = True
+
+
+def delete_contact(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 1, "delete-contact NAME")
+    get_record(contacts, args[0])
+    contacts.delete_record(args[0])
+
+
+def add_note(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 1, "add-note TEXT [#tag]...")
+    tags = []
+    for tag in args[1:]:
+        if tag not in tags:
+            tags.append(tag)
+    for tag in tags:
+        if not match(r"^#\w+$", tag):
+            raise ValueError(f"'{tag}' is not a hashtag")
+    note_id = notes.max_id
+    notes.add_note(args[0], tags)
+    return note_id
+
+
+def tag_note(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "tag NOTE_ID #tag...")
+    note_id = get_note_id(notes, args[0])
+    for tag in args[1:]:
+        notes.add_tag(note_id, tag)
+
+
+def untag_note(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "untag NOTE_ID #tag")
+    note_id = get_note_id(notes, args[0])
+    if args[1] not in notes[note_id]["tags"]:
+        raise KeyError(f"Note {note_id} has no tag '{args[1]}'")
+    notes.delete_tag(note_id, args[1])
+
+
+def update_note(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 2, "update-note NOTE_ID TEXT")
+    notes.update(get_note_id(notes, args[0]), args[1])
+
+
+def delete_note(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 1, "delete-note NOTE_ID")
+    notes.delete_note(get_note_id(notes, args[0]))
+
+
+def search(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 1, "search SCOPE [QUERY]")
+    query = args[1] if len(args) > 1 else ""
+    scopes = {
+        "contacts": contacts.search_all,
+        "name": contacts.search_name,
+        "phone": contacts.search_phone,
+        "email": contacts.search_email,
+        "birthday": lambda days: contacts.search_birthday(int(days)),
+        "notes": notes.search_all,
+        "text": notes.search_text,
+        "tag": notes.search_tag,
+    }
+    if args[0] not in scopes:
+        raise ValueError(f"unknown search scope '{args[0]}'")
+    return scopes[args[0]](query) or []
+
+
+def owner(args, contacts: AddressBook, notes: NoteBook):
+    expect(args, 1, "owner PHONE|EMAIL")
+    if "@" in args[0]:
+        return contacts.find_email(args[0])
+    return contacts.find_phone(args[0])
+
+
+def duplicates(args, contacts: AddressBook, notes: NoteBook):
+    return contacts.find_duplicates()
+
+
+def export_keys(fmt: str, args, contacts: AddressBook, notes: NoteBook):
+    # the search results to export, None for everything
+    from export import EXPORT_FORMATS
+
+    if not args:
+        return None
+    if fmt in EXPORT_FORMATS and \
+            (args[0] in NOTE_SCOPES) != (EXPORT_FORMATS[fmt][0] == "notes"):
+        raise ValueError(f"'{args[0]}' search cannot be exported as {fmt}")
+    return search(args, contacts, notes)
+
+
+def export_books(args, contacts: AddressBook, notes: NoteBook):
+    from export import export
+
+    expect(args, 2, "export FORMAT FILE [SCOPE [QUERY]]")
+    if args[1] == "-":
+        raise ValueError("export to stdout is not possible in a script")
+    keys = export_keys(args[0], args[2:], contacts, notes)
+    return export(args[0], args[1], contacts, notes, keys)
+
+
+def sort(args, contacts: AddressBook, notes: NoteBook):
+    from clean import sort_files
+
+    folder = Path(args[0]) if args and args[0] != "dry-run" else Path(".")
+    # the sorter talks to the user, keep the output machine-readable
+    with redirect_stdout(stderr):
+        report = sort_files(folder, dry_run="dry-run" in args)
+    return report.to_dict()
+
+
+def save(args, contacts: AddressBook, notes: NoteBook):
+    contacts.write_to_file()
+    notes.write_to_file()
+
+
+COMMANDS = {
+    "add-contact": add_contact,
+    "add-phone": add_phone,
+    "del-phone": del_phone,
+    "set-email": set_email,
+    "set-birthday": set_birthday,
+    "delete-contact": delete_contact,
+    "add-note": add_note,
+    "tag": tag_note,
+    "untag": untag_note,
+    "update-note": update_note,
+    "delete-note": delete_note,
+    "search": search,
+    "owner": owner,
+    "duplicates": duplicates,
+    "export": export_books,
+    "sort": sort,
+    "save": save,
+}
+
+
+def run_script(lines, contacts: AddressBook, notes: NoteBook, out=stdout):
+    errors = 0
+    for number, line in enumerate(lines, 1):
+        command = None
+        if line.lstrip().startswith("#"):
+            continue
+        try:
+            args = split(line)
+            if not args:
+                continue
+            command, *args = args
+            if command not in COMMANDS:
+                raise ValueError(f"unknown command '{command}'")
+            result = COMMANDS[command](args, contacts, notes)
+        except (ValueError, KeyError, OSError) as e:
+            # an error stops only its own line, the books are saved anyway
+            errors += 1
+            message = e.args[0] if e.args and not isinstance(e, OSError) \
+                else str(e)
+            out.write(dumps({
+                "line": number,
+                "command": command,
+                "ok": False,
+                "error": str(message),
+            }, ensure_ascii=False) + "\n")
+        else:
+            out.write(dumps({
+                "line": number,
+                "command": command,
+                "ok": True,
+                "result": result,
+            }, ensure_ascii=False) + "\n")
+    return errors
@@ -0,0 +1,370 @@
+import json
+import tracemalloc
+from time import perf_counter
+from random import Random
+from pathlib import Path
+from shutil import copyfile
+from datetime import date, timedelta
+from argparse import ArgumentParser
+from tempfile import TemporaryDirectory
+from multiprocessing import get_context
+from concurrent.futures import ProcessPoolExecutor
+from classes import AddressBook, NoteBook, Record, Name, Phone, Email
+from classes import DATE_FORMAT
+
+SIZES = (10_000, 100_000)
+# calls of every per-item operation (searches, adds, deletes)
+CALLS = 100
+PERCENTILES = (50, 95, 99)
+WORDS = (
+    "alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf",
+    "hotel", "india", "juliet", "kilo", "lima", "mike", "november",
+    "oscar", "papa", "quebec", "romeo", "sierra", "tango", "uniform",
+)
+DOMAINS = ("example.com", "mail.example.com", "test.org", "company.net")
+# Linux: the peak RSS (VmHWM) can be reset between the load and the save
+PROC_STATUS = Path("/proc/self/status")
+PROC_CLEAR_REFS = Path("/proc/self/clear_refs")
+
+
+def make_contacts(count: int, seed: int = 0) -> dict:
+    # the same arguments always give the same contacts (ab.json format)
+    rnd = Random(seed)
+    contacts = {}
+    for i in range(count):
+        name = f"{rnd.choice(WORDS).capitalize()} {rnd.choice(WORDS)} {i}"
+        birthday = date(1950, 1, 1) + timedelta(days=rnd.randrange(20000))
+        contacts[name] = {
+            "name": name,
+            "birthday": birthday.strftime(DATE_FORMAT)
+            if rnd.random() < 0.7 else None,
+            "email": f"{rnd.choice(WORDS)}.{i}@{rnd.choice(DOMAINS)}"
+            if rnd.random() < 0.7 else None,
+            "phone": [
+                f"380{rnd.randrange(10 ** 9):0>9}"
+                for _ in range(rnd.randint(0, 3))
+            ],
+        }
+    return contacts
+
+
+def make_notes(count: int, seed: int = 0) -> dict:
+    # the same arguments always give the same notes (nb.json format)
+    rnd = Random(seed)
+    notes = {}
+    for i in range(count):
+        created = date(2020, 1, 1) + timedelta(days=rnd.randrange(2000))
+        notes[str(i)] = {
+            "text": " ".join(rnd.choice(WORDS) for _ in range(10)),
+            "created": created.strftime(DATE_FORMAT),
+            "tags": sorted(
+                set(f"#{rnd.choice(WORDS)}" for _ in range(rnd.randint(0, 3)))
+            ),
+        }
+    return notes
+
+
+def measure(func, args_list: list) -> dict:
+    latencies = []
+    for args in args_list:
+        start = perf_counter()
+        func(*args)
+        latencies.append(perf_counter() - start)
+    latencies.sort()
+    result = {
+        f"p{p}": latencies[min(len(latencies) - 1, len(latencies) * p // 100)]
+        for p in PERCENTILES
+    }
+    result["ops_per_sec"] = len(latencies) / sum(latencies)
+    return result
+
+
+def measure_memory(func, args_list: list) -> int:
+    # a separate pass: tracemalloc slows the calls down
+    tracemalloc.start()
+    for args in args_list:
+        func(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def read_status(key: str) -> int:
+    for line in PROC_STATUS.read_text().splitlines():
+        if line.startswith(key + ":"):
+            return int(line.split()[1])
+    return 0
+
+
+def reset_peak_rss() -> int:
+    # KiB in use now, the peak starts from here
+    PROC_CLEAR_REFS.write_text("5")
+    return read_status("VmRSS")
+
+
+def rss_load_save(book_class, file_path: Path) -> tuple[int, int]:
+    # runs in a fresh process: KiB over the baseline for a load and a save
+    base = reset_peak_rss()
+    book = book_class(file_path)
+    load_peak = read_status("VmHWM") - base
+    base = reset_peak_rss()
+    book.save_changes = True
+    book.write_to_file()
+    return load_peak, read_status("VmHWM") - base
+
+
+def measure_rss(book_class, file_path: Path) -> tuple[int, int]:
+    if not PROC_CLEAR_REFS.exists():
+        return 0, 0
+    with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+        return pool.submit(rss_load_save, book_class, file_path).result()
+
+
+def print_rss(name: str, book_class, file_path: Path, results: dict):
+    # the JSON load on a copy of the data file alone (no version and no
+    # snapshot), then the load of the file with its snapshot
+    json_path = file_path.with_name("rss_" + file_path.name)
+    copyfile(file_path, json_path)
+    load, save = measure_rss(book_class, json_path)
+    snapshot_load, _ = measure_rss(book_class, file_path)
+    results[name + ".load"]["peak_rss_kib"] = load
+    results[name + ".save"]["peak_rss_kib"] = save
+    results[name + ".load_snapshot"]["peak_rss_kib"] = snapshot_load
+    print(
+        f"{name:<12} peak RSS: load {load} KiB, save {save} KiB,"
+        + f" snapshot load {snapshot_load} KiB"
+    )
+
+
+def run(name: str, func, args_list: list, results: dict, memory=None):
+    results[name] = measure(func, args_list)
+    if memory:
+        results[name]["peak_kib"] = measure_memory(*memory()) // 1024
+    print(
+        f"{name:<28} {results[name]['p50'] * 1000:>10.3f}"
+        + f" {results[name]['p99'] * 1000:>10.3f}"
+        + f" {results[name]['ops_per_sec']:>12.1f}"
+        + f" {results[name].get('peak_kib', ''):>10}"
+    )
+
+
+def bench_contacts(
+    folder: Path, size: int, calls: int, seed: int, rss: bool = False,
+    workers: int = 0,
+) -> dict:
+    rnd = Random(seed)
+    results = {}
+    data = make_contacts(size, seed)
+    file_path = folder / f"ab_{size}.json"
+    file_path.write_text(json.dumps(data), encoding="utf-8")
+    names = list(data)
+    phones = [p for v in data.values() for p in v["phone"]]
+
+    def load():
+        return AddressBook(file_path)
+
+    run("contacts.load", load, [()] * 3, results, lambda: (load, [()]))
+    book = load()
+
+    def save():
+        book.save_changes = True
+        book.write_to_file()
+
+    run("contacts.save", save, [()] * 3, results, lambda: (save, [()]))
+    # a save does not write the snapshot, the end of a session does
+    book.refresh_snapshot()
+    run(
+        "contacts.load_snapshot", load, [()] * 3, results,
+        lambda: (load, [()]),
+    )
+    run("contacts.to_dict", book.to_dict, [()] * 3, results)
+    source = book.to_dict()
+    run(
+        "contacts.from_dict",
+        lambda: AddressBook(folder / "missing.json").from_dict(source),
+        [()] * 3,
+        results,
+    )
+    new_records = [
+        (Record(
+            Name(f"New contact {i}"),
+            email=Email(f"new.{i}@example.com"),
+            phone=[Phone(f"38099{i:0>7}")],
+        ), False)
+        for i in range(calls)
+    ]
+    run("contacts.add_record", book.add_record, new_records, results)
+    run(
+        "contacts.delete_record",
+        book.delete_record,
+        [(r.name.value,) for r, _ in new_records],
+        results,
+    )
+    queries = [(rnd.choice(WORDS)[:3],) for _ in range(calls)]
+    searches = (
+        ("contacts.search_all", book.search_all, queries),
+        ("contacts.search_name", book.search_name, queries),
+        (
+            "contacts.search_phone",
+            book.search_phone,
+            [(rnd.choice(phones)[-6:],) for _ in range(calls)],
+        ),
+        (
+            "contacts.search_birthday",
+            book.search_birthday,
+            [(rnd.randrange(365),) for _ in range(calls)],
+        ),
+    )
+    for name, func, args_list in searches:
+        run(name, func, args_list, results, lambda: (func, args_list[:5]))
+    if workers:
+        book.use_parallel_search(workers)
+        # the first call builds the shared columns
+        book.search_all(queries[0][0])
+        run(
+            f"contacts.search_all[{workers}]",
+            book.search_all,
+            queries,
+            results,
+        )
+        book.scanner.close()
+        book.scanner = None
+    run(
+        "contacts.getitem",
+        book.__getitem__,
+        [(rnd.choice(names),) for _ in range(calls)],
+        results,
+    )
+    if rss:
+        print_rss("contacts", AddressBook, file_path, results)
+    return results
+
+
+def bench_notes(
+    folder: Path, size: int, calls: int, seed: int, rss: bool = False
+) -> dict:
+    rnd = Random(seed)
+    results = {}
+    data = make_notes(size, seed)
+    file_path = folder / f"nb_{size}.json"
+    file_path.write_text(json.dumps(data), encoding="utf-8")
+
+    def load():
+        return NoteBook(file_path)
+
+    run("notes.load", load, [()] * 3, results, lambda: (load, [()]))
+    notes = load()
+
+    def save():
+        notes.save_changes = True
+        notes.write_to_file()
+
+    run("notes.save", save, [()] * 3, results, lambda: (save, [()]))
+    notes.refresh_snapshot()
+    run(
+        "notes.load_snapshot", load, [()] * 3, results, lambda: (load, [()])
+    )
+    run("notes.tags_scan", notes.tags_scan, [()] * 3, results)
+    first_id = notes.max_id
+    run(
+        "notes.add_note",
+        notes.add_note,
+        [(f"new note {i}", [f"#{rnd.choice(WORDS)}"]) for i in range(calls)],
+        results,
+    )
+    run(
+        "notes.delete_note",
+        notes.delete_note,
+        [(first_id + i,) for i in range(calls)],
+        results,
+    )
+    queries = [(rnd.choice(WORDS)[:3],) for _ in range(calls)]
+    searches = (
+        ("notes.search_text", notes.search_text, queries),
+        ("notes.search_tag", notes.search_tag, queries),
+        ("notes.search_all", notes.search_all, queries),
+    )
+    for name, func, args_list in searches:
+        run(name, func, args_list, results, lambda: (func, args_list[:5]))
+    if rss:
+        print_rss("notes", NoteBook, file_path, results)
+    return results
+
+
+def compare(results: dict, baseline: dict):
+    print(f"\n{'Operation':<34} {'p50 base':>10} {'p50 now':>10} {'change':>8}")
+    print("-" * 34 + " " + "-" * 10 + " " + "-" * 10 + " " + "-" * 8)
+    for size, operations in results["results"].items():
+        for name, values in operations.items():
+            old = baseline["results"].get(size, {}).get(name)
+            if not old:
+                continue
+            change = (values["p50"] - old["p50"]) / old["p50"] * 100
+            print(
+                f"{size + ' ' + name:<34} {old['p50'] * 1000:>10.3f}"
+                + f" {values['p50'] * 1000:>10.3f} {change:>+7.1f}%"
+            )
+
+
+def main():
+    parser = ArgumentParser(description="AddressBook/NoteBook benchmarks")
+    parser.add_argument(
+        "--sizes",
+        type=lambda x: [int(n) for n in x.split(",")],
+        default=list(SIZES),
+        help="comma separated dataset sizes, e.g. 10000,100000,1000000",
+    )
+    parser.add_argument("--calls", type=int, default=CALLS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, help="save the results to a JSON file"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="also run search_all on this many processes (parallel.py)",
+    )
+    parser.add_argument(
+        "--rss",
+        action="store_true",
+        help="peak RSS of a load and a save in a fresh process (Linux)",
+    )
+    parser.add_argument(
+        "--compare", type=Path, help="baseline JSON file of an earlier run"
+    )
+    options = parser.parse_args()
+    results = {
+        "config": {
+            "sizes": options.sizes,
+            "calls": options.calls,
+            "seed": options.seed,
+        },
+        "results": {},
+    }
+    with TemporaryDirectory() as tmp:
+        for size in options.sizes:
+            print(f"\n{size} items")
+            print(
+                f"{'Operation':<28} {'p50, ms':>10} {'p99, ms':>10}"
+                + f" {'ops/s':>12} {'peak, KiB':>10}"
+            )
+            print("-" * 28 + " " + "-" * 10 + " " + "-" * 10 + " " + "-" * 12
+                  + " " + "-" * 10)
+            results["results"][str(size)] = {
+                **bench_contacts(
+                    Path(tmp), size, options.calls, options.seed, options.rss,
+                    options.workers,
+                ),
+                **bench_notes(
+                    Path(tmp), size, options.calls, options.seed, options.rss
+                ),
+            }
+    if options.compare:
+        compare(results, json.loads(options.compare.read_text()))
+    if options.output:
+        options.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
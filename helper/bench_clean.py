@@ -0,0 +1,274 @@
+import json
+from io import StringIO
+from time import perf_counter
+from random import Random
+from pathlib import Path
+from zipfile import ZipFile
+from statistics import median
+from hashlib import new as new_hash
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from tempfile import TemporaryDirectory
+from concurrent.futures import ThreadPoolExecutor
+from clean import calc_hash, sort_files, SortRules, CYR
+from clean import HASH_ALGORITHM, HASH_ALGORITHMS, HASH_WORKERS
+
+MB = 1024 * 1024
+# extension -> weight of the synthetic files ("xyz" is not sorted)
+EXTENSION_MIX = {
+    "jpg": 25, "png": 10, "mp4": 5, "mp3": 10,
+    "txt": 20, "pdf": 10, "docx": 5, "xyz": 15,
+}
+LATIN = "abcdefghijklmnopqrstuvwxyz"
+# sort report values compared between runs
+METRICS = (
+    "elapsed", "plan_time", "execute_time", "hash_time", "move_time",
+    "files_per_second", "fs_calls", "bytes_hashed",
+)
+
+
+def make_files(folder: Path, count: int, size: int, seed: int = 0) -> list:
+    rnd = Random(seed)
+    files = []
+    for i in range(count):
+        file_path = folder / f"file_{i:0>4}.bin"
+        file_path.write_bytes(rnd.randbytes(size))
+        files.append(file_path)
+    return files
+
+
+def random_name(rnd: Random, cyrillic: float) -> str:
+    letters = CYR if rnd.random() < cyrillic else LATIN
+    words = (
+        "".join(rnd.choice(letters) for _ in range(rnd.randint(3, 8)))
+        for _ in range(rnd.randint(1, 3))
+    )
+    return " ".join(words).capitalize()
+
+
+def make_tree(
+    folder: Path,
+    files: int = 1000,
+    depth: int = 3,
+    mix: dict = EXTENSION_MIX,
+    cyrillic: float = 0.2,
+    duplicates: float = 0.1,
+    collisions: float = 0.1,
+    archives: int = 5,
+    size: int = 4096,
+    seed: int = 0,
+) -> Path:
+    # the same arguments always give the same tree
+    rnd = Random(seed)
+    root = folder / "tree"
+    folders = [root]
+    for _ in range(max(1, files // 20)):
+        parent = rnd.choice(folders)
+        if len(parent.relative_to(root).parts) < depth:
+            folders.append(parent / random_name(rnd, cyrillic))
+    for f in folders:
+        f.mkdir(parents=True, exist_ok=True)
+    extensions = list(mix)
+    weights = list(mix.values())
+    created = []
+    for i in range(files):
+        target = rnd.choice(folders)
+        r = rnd.random()
+        if created and r < duplicates:
+            # same name and contents in another folder
+            name, data = rnd.choice(created)
+        elif created and r < duplicates + collisions:
+            # same name, other contents
+            name, data = rnd.choice(created)[0], rnd.randbytes(size)
+        else:
+            ext = rnd.choices(extensions, weights)[0]
+            name = f"{random_name(rnd, cyrillic)} {i}.{ext}"
+            data = rnd.randbytes(rnd.randint(size // 2, size))
+        while (target / name).exists():
+            target = rnd.choice(folders)
+            if rnd.random() < 0.5:
+                name = f"{i} {name}"
+        (target / name).write_bytes(data)
+        created.append((name, data))
+    for i in range(archives):
+        with ZipFile(rnd.choice(folders) / f"archive {i}.zip", "w") as z:
+            for j in range(5):
+                z.writestr(f"member_{j}.txt", rnd.randbytes(size))
+    return root
+
+
+def parse_mix(value: str) -> dict:
+    # "jpg=30,txt=20,xyz=5"
+    mix = {}
+    for item in value.split(","):
+        ext, _, weight = item.partition("=")
+        mix[ext.strip().lstrip(".")] = float(weight or 1)
+    return mix
+
+
+def bench_sort(options) -> dict:
+    config = {
+        "files": options.files,
+        "depth": options.depth,
+        "mix": options.mix,
+        "cyrillic": options.cyrillic,
+        "duplicates": options.duplicates,
+        "collisions": options.collisions,
+        "archives": options.archives,
+        "size": options.size,
+        "seed": options.seed,
+        "hash": options.hash,
+        "repeat": options.repeat,
+    }
+    runs = []
+    for _ in range(options.repeat):
+        with TemporaryDirectory() as tmp:
+            root = make_tree(
+                Path(tmp),
+                files=options.files,
+                depth=options.depth,
+                mix=options.mix,
+                cyrillic=options.cyrillic,
+                duplicates=options.duplicates,
+                collisions=options.collisions,
+                archives=options.archives,
+                size=options.size,
+                seed=options.seed,
+            )
+            start = perf_counter()
+            with redirect_stdout(StringIO()):
+                report = sort_files(
+                    root, algorithm=options.hash, rules=SortRules()
+                )
+            run = report.to_dict()
+            run["total_time"] = perf_counter() - start
+            runs.append(run)
+    summary = {
+        name: median(run[name] for run in runs)
+        for name in ("total_time",) + METRICS
+    }
+    return {
+        "benchmark": "sort",
+        "config": config,
+        "summary": summary,
+        "runs": runs,
+    }
+
+
+def compare(results: dict, baseline: dict):
+    if results["config"] != baseline["config"]:
+        print("Warning: the baseline was made with another configuration.")
+    print(f"{'Metric':<18} {'baseline':>12} {'current':>12} {'change':>8}")
+    print("-" * 18 + " " + "-" * 12 + " " + "-" * 12 + " " + "-" * 8)
+    for name, value in results["summary"].items():
+        old = baseline["summary"].get(name)
+        if old is None:
+            continue
+        change = f"{(value - old) / old * 100:+.1f}%" if old else ""
+        print(f"{name:<18} {old:>12.4f} {value:>12.4f} {change:>8}")
+
+
+def legacy_hash(file_path: Path, algorithm: str) -> str:
+    # the former implementation: a new bytes object per read
+    md = new_hash(algorithm)
+    with open(file_path, "rb") as f:
+        while data := f.read(128 * 1024):
+            md.update(data)
+    return md.hexdigest()
+
+
+def hash_configurations():
+    for algorithm in HASH_ALGORITHMS:
+        yield f"{algorithm} read", lambda p, a=algorithm: legacy_hash(p, a), 1
+        yield (
+            f"{algorithm} readinto",
+            lambda p, a=algorithm: calc_hash(p, a, use_mmap=False),
+            1,
+        )
+        yield (
+            f"{algorithm} mmap",
+            lambda p, a=algorithm: calc_hash(p, a, use_mmap=True),
+            1,
+        )
+        yield (
+            f"{algorithm} readinto x{HASH_WORKERS}",
+            lambda p, a=algorithm: calc_hash(p, a, use_mmap=False),
+            HASH_WORKERS,
+        )
+
+
+def bench_hash(files: list, repeat: int) -> dict:
+    size = sum(f.stat().st_size for f in files) / MB
+    results = {}
+    for name, func, workers in hash_configurations():
+        best = None
+        for _ in range(repeat):
+            start = perf_counter()
+            if workers == 1:
+                for f in files:
+                    func(f)
+            else:
+                with ThreadPoolExecutor(workers) as pool:
+                    list(pool.map(func, files))
+            elapsed = perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = size / best
+    return results
+
+
+def main():
+    parser = ArgumentParser(description="clean.py benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+    hash_parser = commands.add_parser("hash", help="hashing throughput")
+    hash_parser.add_argument("--files", type=int, default=16)
+    hash_parser.add_argument("--size", type=int, default=8, help="MB")
+    hash_parser.add_argument("--repeat", type=int, default=3)
+    sort_parser = commands.add_parser("sort", help="sort_files timings")
+    sort_parser.add_argument("--files", type=int, default=1000)
+    sort_parser.add_argument("--depth", type=int, default=3)
+    sort_parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default=EXTENSION_MIX,
+        help="extension weights, e.g. jpg=30,txt=20,xyz=5",
+    )
+    sort_parser.add_argument("--cyrillic", type=float, default=0.2)
+    sort_parser.add_argument("--duplicates", type=float, default=0.1)
+    sort_parser.add_argument("--collisions", type=float, default=0.1)
+    sort_parser.add_argument("--archives", type=int, default=5)
+    sort_parser.add_argument("--size", type=int, default=4096, help="bytes")
+    sort_parser.add_argument("--seed", type=int, default=0)
+    sort_parser.add_argument(
+        "--hash", choices=HASH_ALGORITHMS, default=HASH_ALGORITHM
+    )
+    sort_parser.add_argument("--repeat", type=int, default=3)
+    sort_parser.add_argument(
+        "--output", type=Path, help="save the results to a JSON file"
+    )
+    sort_parser.add_argument(
+        "--compare", type=Path, help="JSON results of an earlier run"
+    )
+    options = parser.parse_args()
+    if options.command == "hash":
+        with TemporaryDirectory() as tmp:
+            files = make_files(Path(tmp), options.files, options.size * MB)
+            results = bench_hash(files, options.repeat)
+        print(f"{'Configuration':<24} {'MB/s':>10}")
+        print("-" * 24 + " " + "-" * 10)
+        for name, speed in results.items():
+            print(f"{name:<24} {speed:>10.1f}")
+    elif options.command == "sort":
+        results = bench_sort(options)
+        if options.compare:
+            compare(results, json.loads(options.compare.read_text()))
+        else:
+            print(f"{'Metric':<18} {'median':>12}")
+            print("-" * 18 + " " + "-" * 12)
+            for name, value in results["summary"].items():
+                print(f"{name:<18} {value:>12.4f}")
+        if options.output:
+            options.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import json
+import sys
+from time import perf_counter
+from pathlib import Path
+from statistics import median
+from argparse import ArgumentParser
+from subprocess import Popen, PIPE
+from tempfile import TemporaryDirectory
+from bench_classes import make_contacts, make_notes
+
+BOT = Path(__file__).resolve().parent / "bot.py"
+PROMPT = b"Select an option"
+
+
+def time_to_prompt(folder: Path) -> tuple[float, float]:
+    # seconds to the first main menu prompt and to the end of the session
+    start = perf_counter()
+    bot = Popen(
+        [sys.executable, "-u", str(BOT)],
+        cwd=folder,
+        stdin=PIPE,
+        stdout=PIPE,
+    )
+    output = b""
+    while PROMPT not in output:
+        data = bot.stdout.read1(4096)
+        if not data:
+            raise RuntimeError("bot-helper exited before the first prompt")
+        output += data
+    first_prompt = perf_counter() - start
+    bot.communicate(b"0\n")
+    return first_prompt, perf_counter() - start
+
+
+def main():
+    parser = ArgumentParser(description="bot-helper time to first prompt")
+    parser.add_argument("--contacts", type=int, default=100_000)
+    parser.add_argument("--notes", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output", type=Path, help="save the results to a JSON file"
+    )
+    options = parser.parse_args()
+    with TemporaryDirectory() as tmp:
+        folder = Path(tmp)
+        (folder / "ab.json").write_text(
+            json.dumps(make_contacts(options.contacts, options.seed)),
+            encoding="utf-8",
+        )
+        (folder / "nb.json").write_text(
+            json.dumps(make_notes(options.notes, options.seed)),
+            encoding="utf-8",
+        )
+        runs = [time_to_prompt(folder) for _ in range(options.repeat)]
+    results = {
+        "config": {
+            "contacts": options.contacts,
+            "notes": options.notes,
+            "repeat": options.repeat,
+        },
+        "first_prompt": median(r[0] for r in runs),
+        "session": median(r[1] for r in runs),
+    }
+    print(f"{options.contacts} contacts, {options.notes} notes")
+    print(f"time to first prompt: {results['first_prompt']:.3f} s")
+    print(f"start, load and exit: {results['session']:.3f} s")
+    if options.output:
+        options.output.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
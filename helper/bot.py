@@ -1,8 +1,13 @@
 from re import search
+from sys import argv, stdin, stderr
 from pathlib import Path
+from argparse import ArgumentParser
+from contextlib import nullcontext
 from classes import AddressBook, Record, Phone, Birthday, Name, Email
-from classes import NoteBook, RECORD_HEADER, LINE, NOTE_HEADER
-from clean import sort_files
+from classes import NoteBook, LazyBook, AutoSaver
+from classes import RECORD_HEADER, LINE, NOTE_HEADER
+from classes import FILE_ADDRESSBOOK, FILE_NOTEBOOK, SHARD_COUNT
+from profiling import get_profiler, PROFILE_FLAG, PROFILE_ENV
 
 TEXT_FORMAT = "%d %b %Y"
 SELECT_CONTACT = "Press Enter or type a row number to select a contact: "
@@ -20,6 +25,7 @@ A_CONTACTS_BY_BIRTHDAY = 66
 A_NOTE_BY_TEXT = 97
 A_NOTE_BY_TAG = 98
 A_SORT_FOLDER = 99
+A_EXPORT = 100
 A_ADD = 4
 A_ADD_BD = 5
 A_ADD_EM = 6
@@ -43,11 +49,12 @@ MESSAGE = {
         + "2 = Add new note\n"
         + "3 = Show all contacts\n"
         + "4 = Search contacts by birthday\n"
-        + "5 = Search contacts using name and/or phone\n"
+        + "5 = Search contacts using name, phone or e-mail\n"
         + "6 = Show all notes\n"
         + "7 = Search notes using text\n"
         + "8 = Search notes using hashtag\n"
         + "9 = Sort files\n"
+        + "10 = Export contacts or notes\n"
         + "0 = Exit (Ctrl+C)\n"
         + LINE
         + "\nNB: Options from 3 to 7 allow to select one item for update\n"
@@ -67,7 +74,10 @@ MESSAGE = {
     A_ADD_BD: ENTER_BIRTHDAY,
     A_ADD_EM: ENTER_EMAIL,
     A_ADD_PH: ENTER_PHONE,
-    A_CONTACTS_BY_NAME: "Enter a pattern to search contacts: ",
+    A_CONTACTS_BY_NAME: (
+        "Enter a pattern to search contacts"
+        + " (name, phone, e-mail or @domain): "
+    ),
     A_CONTACTS_BY_BIRTHDAY: "Enter days to birthday: ",
     A_NOTE_BY_TEXT: "Enter a text pattern to search notes: ",
     A_NOTE_BY_TAG: "Enter a text pattern to search tags: ",
@@ -75,10 +85,19 @@ MESSAGE = {
         "\n\nYou are about to start sorting files.\n"
         + LINE
         + "\nPlease specify folder name or leave it blank and press Enter"
-        + f"\nto use the current folder ({Path('.').parent.resolve()})\n"
+        + "\nto use the current folder ({})\n"
         + LINE
         + "\nEnter folder name: "
     ),
+    A_EXPORT: (
+        "\n\nYou are about to export contacts or notes.\n"
+        + LINE
+        + "\nFormats: vcard, csv (contacts), markdown, jsonl (notes)"
+        + "\nAdd a search pattern to export only the matching items,"
+        + "\ne.g. 'vcard work.vcf @example.com' or 'jsonl notes.jsonl #work'\n"
+        + LINE
+        + "\nEnter format, file name and pattern: "
+    ),
     A_EDIT: (
         "1 = Add new phone(s)\n"
         + "2 = Delete existing phone\n"
@@ -128,19 +147,79 @@ MESSAGE = {
 }
 CTRL_C = "{~"
 F6 = "}~"
+# action id -> constant name, e.g. 65 -> "A_CONTACTS_BY_NAME"
+ACTION_NAMES = {
+    value: name for name, value in list(globals().items())
+    if name.startswith("A_")
+}
+BOOK_METHODS = {
+    AddressBook: (
+        "read_from_file", "write_to_file", "search_all", "search_name",
+        "search_phone", "search_birthday", "search_email",
+    ),
+    NoteBook: (
+        "read_from_file", "write_to_file", "search_all", "search_text",
+        "search_tag",
+    ),
+}
+
+# set up by start(), not on import: the spawn workers of the process
+# pools import the main script again and must not load the books
+profiler = None
+autosaver = None
+contacts = None
+notes = None
 
-contacts = AddressBook()
-notes = NoteBook()
 
+def start():
+    global profiler, autosaver, contacts, notes
+    # opt-in timings (BOT_HELPER_PROFILE or --profile), set up before the
+    # books so that loading them is measured too
+    profiler = get_profiler(argv[1:])
+    if profiler:
+        for book_class, methods in BOOK_METHODS.items():
+            profiler.instrument(book_class, methods)
+    # the books are loaded in the background while the menu is shown
+    # and saved in the background after every series of changes
+    autosaver = AutoSaver()
+    contacts = LazyBook(AddressBook, FILE_ADDRESSBOOK, autosaver)
+    notes = LazyBook(NoteBook, FILE_NOTEBOOK, autosaver)
 
 def input_str(message: str) -> str:
-    try:
-        return input(message).strip()
-    except EOFError:
-        return F6
-    except KeyboardInterrupt:
-        print()
-        return CTRL_C
+    # waiting for the user is not counted in the action timings
+    with profiler.paused() if profiler else nullcontext():
+        try:
+            return input(message).strip()
+        except EOFError:
+            return F6
+        except KeyboardInterrupt:
+            print()
+            return CTRL_C
+
+
+def sync_books():
+    # another session may have saved the same files in the meantime
+    for book, kind in ((contacts, "contacts"), (notes, "notes")):
+        try:
+            merged = book.sync()
+        except (OSError, ValueError) as e:
+            print(f"\nERROR: cannot check {book.file_path}: {e}")
+            continue
+        if merged:
+            print(f"\n[{merged} {kind} updated by another session]")
+        if book.conflicts:
+            print(
+                f"\n[{', '.join(map(str, book.conflicts))} changed here and"
+                + " in another session: kept this version, the other one is"
+                + f" in {book.file_path}.conflicts]"
+            )
+            book.conflicts.clear()
+
+
+def warn_shared_phone(phone: Phone, name: str):
+    owners = [n for n in contacts.find_phone(phone.value) if n != name]
+    if owners:
+        print(f"Phone '{phone}' also belongs to {', '.join(owners)}.")
 
 
 def add_sequence(user_input: str, selected: Record, action: int):
@@ -192,6 +271,7 @@ def add_sequence(user_input: str, selected: Record, action: int):
                 else:
                     selected.add_phone(phone)
                     print(f"Phone '{phone}' added.")
+                    warn_shared_phone(phone, selected.name.value)
             contacts.add_record(selected)
             return A_MAIN, None
     elif action == A_ADD_BD:
@@ -260,6 +340,7 @@ def edit_sequence(user_input: str, selected: Record, action: int):
             else:
                 if contacts[selected.name.value].add_phone(phone):
                     print(f"Phone '{phone}' added.")
+                    warn_shared_phone(phone, selected.name.value)
                     contacts.save_changes = True
                 else:
                     print(f"Phone '{phone}' already exists.")
@@ -429,6 +510,8 @@ def search_contacts(user_input: str, selected, action: int):
             return action, selected
         else:
             name_list = contacts.search_birthday(days)
+    elif action == A_CONTACTS_BY_NAME and "@" in user_input:
+        name_list = contacts.search_email(user_input)
     elif action == A_CONTACTS_BY_NAME:
         name_list = contacts.search_all(user_input)
     return show_contacts(name_list)
@@ -465,18 +548,45 @@ def search_notes(user_input: str, selected, action: int):
 
 
 def sort_folder(user_input: str, selected, action: int):
+    from clean import sort_files
+
     path = Path(user_input) if user_input else Path(".")
     try:
         sort_files(path)
     except ValueError as e:
         print(f"\n{str(e)}\n")
+    except KeyboardInterrupt:
+        print("\nSorting interrupted, sort the folder again to resume.\n")
+    return A_MAIN, None
+
+
+def export_books(user_input: str, selected, action: int):
+    from export import export, search_keys, EXPORT_FORMATS
+
+    if user_input in (F6, CTRL_C, ""):
+        return A_MAIN, None
+    fmt, _, rest = user_input.partition(" ")
+    file_name, _, pattern = rest.strip().partition(" ")
+    if fmt not in EXPORT_FORMATS or not file_name:
+        print("\nFormat and file name are expected\n")
+        return action, selected
+    kind = EXPORT_FORMATS[fmt][0]
+    try:
+        keys = search_keys(kind, contacts, notes, pattern.strip())
+        count = export(fmt, file_name, contacts, notes, keys)
+    except OSError as e:
+        print(f"\nERROR: {e}\n")
+        return action, selected
+    print(f"\n{count} {kind} exported to '{file_name}'.\n")
     return A_MAIN, None
 
 
 def main_menu(user_input: str, selected, action: int):
     if user_input == "0" or user_input == CTRL_C:  # = Exit (Ctrl+C)
-        contacts.write_to_file()
-        notes.write_to_file()
+        autosaver.stop()
+        for book in (contacts, notes):
+            book.write_to_file()
+            book.refresh_snapshot()
         print("Good bye!")
         exit()
     if user_input == "1":            # = Add new contact
@@ -487,7 +597,7 @@ def main_menu(user_input: str, selected, action: int):
         return show_contacts(sorted(contacts.data.keys()))
     if user_input == "4":            # = Search contacts by birthday
         return A_CONTACTS_BY_BIRTHDAY, None
-    if user_input == "5":            # = Search contacts using name & phone
+    if user_input == "5":            # = Search contacts using name, phone, e-mail
         return A_CONTACTS_BY_NAME, None
     if user_input == "6":            # = Show all notes
         return show_notes(sorted(notes.data.keys()))
@@ -497,6 +607,8 @@ def main_menu(user_input: str, selected, action: int):
         return A_NOTE_BY_TAG, None
     if user_input == "9":            # = Sort folder
         return A_SORT_FOLDER, None
+    if user_input == "10":           # = Export contacts or notes
+        return A_EXPORT, None
     else:
         print("\nUnrecognized command\n")
     return A_MAIN, None
@@ -509,6 +621,7 @@ menu_functions = {
     A_NOTE_BY_TEXT: search_notes,
     A_NOTE_BY_TAG: search_notes,
     A_SORT_FOLDER: sort_folder,
+    A_EXPORT: export_books,
     A_ADD: add_sequence,
     A_ADD_BD: add_sequence,
     A_ADD_EM: add_sequence,
@@ -529,18 +642,198 @@ menu_functions = {
 }
 
 
+def run_command(args: list[str]):
+    from batch import run_script, export_keys
+    from export import export, EXPORT_FORMATS
+    from clean import sort_files, watch_folder, load_rules, RULES_FILE
+    from clean import HASH_ALGORITHM, HASH_ALGORITHMS, WATCH_INTERVAL
+
+    parser = ArgumentParser(
+        prog="bot-helper",
+        epilog=f"{PROFILE_FLAG}[=time,cprofile,memory] (or {PROFILE_ENV})"
+        + " prints per-action timings on exit",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    sort_parser = commands.add_parser("sort", help="sort files in a folder")
+    sort_parser.add_argument("folder", nargs="?", default=".")
+    sort_parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="show the planned changes without touching the files",
+    )
+    sort_parser.add_argument(
+        "--hash",
+        choices=HASH_ALGORITHMS,
+        default=HASH_ALGORITHM,
+        help="algorithm used to compare files with equal names",
+    )
+    sort_parser.add_argument(
+        "--report",
+        type=Path,
+        help="save the sort report and its metrics to a JSON file",
+    )
+    sort_parser.add_argument(
+        "--rules",
+        type=Path,
+        default=RULES_FILE,
+        help="JSON file with extra sort folders and extensions",
+    )
+    sort_parser.add_argument(
+        "--sniff",
+        action="store_true",
+        default=None,
+        help="look at the contents of files with unknown extensions",
+    )
+    sort_parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep sorting the new files coming into the folder",
+    )
+    sort_parser.add_argument(
+        "--interval",
+        type=float,
+        default=WATCH_INTERVAL,
+        help="seconds between two checks of the watched folder",
+    )
+    exec_parser = commands.add_parser(
+        "exec", help="run contact and note commands from a script"
+    )
+    exec_parser.add_argument(
+        "script",
+        nargs="?",
+        type=Path,
+        help="script file (commands are read from stdin if omitted)",
+    )
+    export_parser = commands.add_parser(
+        "export", help="export contacts (vcard, csv) or notes (markdown, jsonl)"
+    )
+    export_parser.add_argument("format", choices=EXPORT_FORMATS)
+    export_parser.add_argument(
+        "output", nargs="?", default="-", help="file name (default: stdout)"
+    )
+    export_parser.add_argument(
+        "--search",
+        nargs="+",
+        metavar=("SCOPE", "QUERY"),
+        help="export only the results of a search, e.g. '--search tag #work'",
+    )
+    storage_parser = commands.add_parser(
+        "storage", help="keep the books in single files or in shards"
+    )
+    storage_parser.add_argument("layout", choices=("single", "shards"))
+    storage_parser.add_argument(
+        "--count",
+        type=int,
+        default=SHARD_COUNT,
+        help="number of contact shards (notes are split by id ranges)",
+    )
+    options = parser.parse_args(args)
+    if options.command == "sort":
+        try:
+            rules = load_rules(options.rules, options.sniff)
+            if options.watch:
+                watch_folder(
+                    Path(options.folder),
+                    interval=options.interval,
+                    algorithm=options.hash,
+                    rules=rules,
+                )
+            else:
+                report = sort_files(
+                    Path(options.folder),
+                    dry_run=options.dry_run,
+                    algorithm=options.hash,
+                    rules=rules,
+                )
+                if options.report:
+                    options.report.write_text(
+                        report.to_json(), encoding="utf-8"
+                    )
+        except ValueError as e:
+            print(e)
+            exit(1)
+    elif options.command == "exec":
+        try:
+            if options.script:
+                with open(options.script, "r", encoding="utf-8") as f:
+                    errors = run_script(f, contacts, notes)
+            else:
+                errors = run_script(stdin, contacts, notes)
+        finally:
+            # the changes made before an unexpected error are kept
+            for book in (contacts, notes):
+                book.write_to_file()
+                book.refresh_snapshot()
+        if errors:
+            exit(1)
+    elif options.command == "storage":
+        for book in (contacts, notes):
+            book.set_storage(options.layout == "shards", options.count)
+            print(
+                f"{book.file_path}: {len(book)} entries"
+                + (f" in {len(book.shards)} shards" if book.sharded else "")
+            )
+    elif options.command == "export":
+        try:
+            keys = export_keys(options.format, options.search, contacts, notes)
+            count = export(
+                options.format, options.output, contacts, notes, keys
+            )
+        except (ValueError, KeyError, OSError) as e:
+            print(e, file=stderr)
+            exit(1)
+        print(f"{count} exported", file=stderr)
+
+
+def wait_books():
+    # the time the books still take to load is measured apart, so that it
+    # is not charged to the first action (or command) that uses them
+    for book, name in ((contacts, "LOAD_CONTACTS"), (notes, "LOAD_NOTES")):
+        if not book.is_loaded():
+            profiler.measure(name, book.wait)
+
+
 def bot_helper():
+    start()
+    args = [arg for arg in argv[1:] if not arg.startswith(PROFILE_FLAG)]
+    if args:
+        if profiler:
+            wait_books()
+            return profiler.measure(
+                "COMMAND_" + args[0].upper(), run_command, args, profile=True
+            )
+        return run_command(args)
+    autosaver.start([contacts, notes])
     action = A_MAIN
     selected = None
     while True:
         if action == A_MAIN:
-            cnt = f"\n[{len(contacts)} contacts] [{len(notes)} notes]"
+            if contacts.is_loaded() and notes.is_loaded():
+                sync_books()
+                cnt = f"\n[{len(contacts)} contacts] [{len(notes)} notes]"
+            else:
+                cnt = "\n[loading contacts and notes...]"
             print(cnt + "\n" + LINE)
-        action, selected = menu_functions[action](
-            input_str(MESSAGE[action]),
-            selected,
-            action
-        )
+        message = MESSAGE[action]
+        if action == A_SORT_FOLDER:
+            message = message.format(Path(".").resolve())
+        user_input = input_str(message)
+        if profiler:
+            wait_books()
+            action, selected = profiler.measure(
+                ACTION_NAMES[action],
+                menu_functions[action],
+                user_input,
+                selected,
+                action,
+                profile=True,
+            )
+        else:
+            action, selected = menu_functions[action](
+                user_input,
+                selected,
+                action
+            )
 
 
 if __name__ == "__main__":
@@ -1,8 +1,21 @@
+import os
 import json
+from threading import Thread, Event, Lock
+from tempfile import mkstemp
 from collections import UserDict
 from pathlib import Path
-from datetime import datetime
+from bisect import bisect_left, insort
+from datetime import datetime, date
 from re import search
+from zlib import crc32
+from struct import error as struct_error
+from shutil import rmtree
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from jsonstream import dump_entries, load_entries, encode
+from filelock import locked
+from snapshot import Snapshot, SnapshotData, Mapped, dump_snapshot
+from snapshot import TEXT_KEYS, NUMBER_KEYS
 
 DATE_FORMAT = "%Y-%m-%d"
 TEXT_FORMAT = "%d %b %Y"
@@ -20,6 +33,29 @@ NOTE_HEADER = (
     + "-" * 5 + " " + "-" * 10 + " " + "-" * 60
 )
 LINE = "-" * 60
+# seconds without changes before the books are saved in the background
+AUTOSAVE_DELAY = 2.0
+# search_all goes parallel (parallel.py) for books this big
+PARALLEL_SEARCH_MIN = 1_000_000
+# the data files are written through a bigger buffer, entry by entry
+WRITE_BUFFER = 1 << 20
+# <file>.version: {"version": number of saves, "stamp": [mtime, size]} of
+# the single data file, which stays a plain JSON object of the entries
+VERSION_SUFFIX = ".version"
+# sharded books: <file>.d/manifest.json and <file>.d/NNNN.json, contacts
+# are spread by the hash of the name, notes by ranges of ids
+SHARDS_SUFFIX = ".d"
+MANIFEST = "manifest.json"
+SHARD_COUNT = 16
+SHARD_SIZE = 10_000
+# <file>.snap (snapshot.py) is read instead of the data file when it has
+# the same version; it is rewritten when a session ends or loads the data
+# files, not with every save (all the entries are converted and sorted)
+SNAPSHOT_SUFFIX = ".snap"
+# snapshot columns of the contacts and of the notes
+NAME_COLUMN, LOWER_NAME_COLUMN, EMAIL_COLUMN, PHONE_COLUMN = range(4)
+TEXT_COLUMN, LOWER_TEXT_COLUMN, TAGS_COLUMN = range(3)
+TAG_SEPARATOR = "\x1f"
 
 
 class Field:
@@ -73,6 +109,13 @@ class Birthday(Field):
             raise ValueError(f"'{value}' is not a valid date")
         Field.value.fset(self, birthday)
 
+    @classmethod
+    def from_datetime(cls, value: datetime):
+        # a date that is known to be valid (snapshot), nothing is parsed
+        birthday = cls.__new__(cls)
+        Field.value.fset(birthday, value)
+        return birthday
+
     def replace_year(self, year: int) -> datetime:
         try:
             return self.value.replace(year=year)
@@ -98,6 +141,8 @@ class Birthday(Field):
 
 class Record:
     def __init__(self, name: Name, birthday=None, email=None, phone=None):
+        # the AddressBook the record is in, it keeps the phone/email index
+        self.book = None
         self.name = name
         self.phone: list[Phone] = []
         if phone:
@@ -105,28 +150,48 @@ class Record:
         self.birthday = birthday
         self.email = email
 
+    @property
+    def birthday(self):
+        return self._birthday
+
+    @birthday.setter
+    def birthday(self, birthday):
+        self._birthday = birthday
+        if self.book:
+            self.book.touch(self)
+
+    @property
+    def email(self):
+        return self._email
+
+    @email.setter
+    def email(self, email):
+        if self.book:
+            self.book.unindex_email(self)
+        self._email = email
+        if self.book:
+            self.book.index_email(self)
+
     def is_phone(self, phone) -> bool:
-        if self.phone:
-            if phone.value in set(p.value for p in self.phone):
-                return True
-        return False
+        return any(p.value == phone.value for p in self.phone)
 
     def add_phone(self, phone):
         add_counter = 0
-        if isinstance(phone, list):
-            for p in phone:
-                if not self.is_phone(p):
-                    self.phone.append(p)
-                    add_counter += 1
-        elif not self.is_phone(phone):
-            self.phone.append(phone)
-            add_counter = 1
+        for p in phone if isinstance(phone, list) else [phone]:
+            if not self.is_phone(p):
+                self.phone.append(p)
+                add_counter += 1
+                if self.book:
+                    self.book.index_add(self.book.phones, p.value, self)
         return add_counter
 
     def del_phone(self, phone):
-        if self.is_phone(phone):
-            self.phone.remove(phone)
-            return True
+        for p in self.phone:
+            if p.value == phone.value:
+                self.phone.remove(p)
+                if self.book:
+                    self.book.index_remove(self.book.phones, p.value, self)
+                return True
 
     def __str__(self) -> str:
         phones = ", ".join(str(p) for p in self.phone)
@@ -144,89 +209,892 @@ class Record:
         return False
 
 
-class AddressBook(UserDict):
-    def __init__(self, filename=FILE_ADDRESSBOOK):
-        super().__init__()
+def reverse_domain(email: str) -> str:
+    # "name@mail.example.com" -> "com.example.mail"
+    return ".".join(reversed(email.rpartition("@")[2].split(".")))
+
+
+def make_record(value: dict) -> Record:
+    return Record(
+        Name(value["name"]),
+        birthday=Birthday(value["birthday"]) if value["birthday"] else None,
+        email=Email(value["email"]) if value["email"] else None,
+        phone=[Phone(x) for x in value["phone"]],
+    )
+
+
+def date_ordinal(text) -> int:
+    # snapshot dates, 0 for none; a date that would not be written back
+    # the same way (not "yyyy-mm-dd") raises ValueError
+    if not text:
+        return 0
+    day = date.fromisoformat(text)
+    if day.isoformat() != text:
+        raise ValueError(f"'{text}' does not match the expected format")
+    return day.toordinal()
+
+
+def ordinal_date(ordinal: int):
+    return date.fromordinal(ordinal).isoformat() if ordinal else None
+
+
+def write_atomic(file_path: Path, dump, binary: bool = False):
+    # the old file stays intact until the new one is completely written
+    fd, tmp = mkstemp(
+        dir=file_path.parent, prefix=file_path.name + ".", suffix=".tmp"
+    )
+    try:
+        with (
+            open(fd, "wb", buffering=WRITE_BUFFER) if binary
+            else open(fd, "w", encoding="utf-8", buffering=WRITE_BUFFER)
+        ) as f:
+            dump(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(
+            tmp,
+            file_path.stat().st_mode & 0o777 if file_path.exists() else 0o644
+        )
+        os.replace(tmp, file_path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+class AutoSaver:
+    # saves the books on a background thread once they stop changing
+    def __init__(self, delay: float = AUTOSAVE_DELAY):
+        self.delay = delay
+        self.books = []
+        self.dirty = Event()
+        self.stopping = Event()
+        self.thread = None
+
+    def notify(self):
+        self.dirty.set()
+
+    def start(self, books: list):
+        self.books = books
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self.stopping.set()
+        self.dirty.set()
+        if self.thread:
+            self.thread.join()
+
+    def run(self):
+        while not self.stopping.is_set():
+            self.dirty.wait()
+            # every new change restarts the quiet period
+            while self.dirty.is_set() and not self.stopping.is_set():
+                self.dirty.clear()
+                self.stopping.wait(self.delay)
+            if self.stopping.is_set():
+                break
+            for book in self.books:
+                try:
+                    # the changes of another session are merged on the main
+                    # thread only (sync), until then the save is retried
+                    if not book.write_to_file(merge=False):
+                        self.dirty.set()
+                except OSError as e:
+                    print(f"\nERROR: autosave of {book.file_path} failed: {e}")
+
+
+def entry_hash(value) -> int:
+    # the same in every process (shards are read by a process pool)
+    return crc32(encode(value).encode("utf-8"))
+
+
+def file_stamp(file_path: Path):
+    try:
+        stat = file_path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def load_shard(file_path: Path) -> tuple[list, dict]:
+    # runs in a pool process: the entries of a shard and their hashes
+    # (records are not made here, unpickling them costs more than that)
+    entries = []
+    hashes = {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        for key, value in load_entries(f):
+            entries.append((key, value))
+            hashes[key] = entry_hash(value)
+    return entries, hashes
+
+
+class BookFile:
+    # change tracking and saving shared by AddressBook and NoteBook;
+    # several sessions may use the same file: the file is locked while it
+    # is read or written, and the changes made by another session (seen by
+    # the mtime, size and version) are merged entry by entry;
+    # a book is either one file or shards in <file>.d/ with a manifest,
+    # only the shards with changed entries are written;
+    # a snapshot of the same version is read instead of the data files
+    def init_file(self, filename, autosaver=None):
         self.file_path = Path(filename)
+        self.shard_dir = self.file_path.with_name(
+            self.file_path.name + SHARDS_SUFFIX
+        )
+        self.snapshot_path = self.file_path.with_name(
+            self.file_path.name + SNAPSHOT_SUFFIX
+        )
+        self.version_path = self.file_path.with_name(
+            self.file_path.name + VERSION_SUFFIX
+        )
+        # the Snapshot the data is read from, None for a dict
+        self.snapshot = None
+        # the version of the snapshot file as last read or written
+        self.snapshot_version = 0
+        self.autosaver = autosaver
+        self.save_lock = Lock()
+        self.changes = 0
+        self._save_changes = False
+        self.version = 0
+        # a single file or shards (the numbers of the non-empty ones)
+        self.sharded = False
+        self.shards: list = []
+        self.shard_count = SHARD_COUNT
+        self.shard_size = SHARD_SIZE
+        # path -> (mtime, size) of the files as last read or written
+        self.stamps: dict = {}
+        # key -> hash of the entry as it is in the file
+        self.synced: dict = {}
+        # keys changed in this session since the last save
+        self.dirty: set = set()
+        # keys changed both here and in another session
+        self.conflicts: list = []
+
+    @property
+    def save_changes(self) -> bool:
+        return self._save_changes
+
+    @save_changes.setter
+    def save_changes(self, value: bool):
+        if value:
+            self.changes += 1
+            if self.autosaver:
+                self.autosaver.notify()
+        self._save_changes = value
+
+    def manifest_path(self) -> Path:
+        return self.shard_dir / MANIFEST
+
+    def shard_path(self, shard: int) -> Path:
+        return self.shard_dir / f"{shard:04}.json"
+
+    def data_paths(self) -> list[Path]:
+        if not self.sharded:
+            return [self.file_path]
+        return [self.shard_path(shard) for shard in self.shards]
+
+    def read_manifest(self):
+        try:
+            with open(self.manifest_path(), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def use_manifest(self, manifest):
+        self.sharded = manifest is not None
+        if manifest:
+            self.version = manifest["version"]
+            self.shards = manifest["shards"]
+            self.shard_count = manifest["count"]
+            self.shard_size = manifest["size"]
+        else:
+            self.shards = []
+
+    def file_stamps(self) -> dict:
+        paths = self.data_paths()
+        if self.sharded:
+            paths.append(self.manifest_path())
+        return {path: file_stamp(path) for path in paths}
+
+    def version_info(self) -> dict:
+        try:
+            with open(self.version_path, "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+        return info if isinstance(info, dict) else {}
+
+    def read_version(self) -> int:
+        # 0 if the data file was not written with its version file (by an
+        # older release or by hand), its snapshot cannot be trusted then
+        if self.sharded:
+            return self.version
+        info = self.version_info()
+        stamp = file_stamp(self.file_path)
+        if stamp is None or info.get("stamp") != list(stamp):
+            return 0
+        return info.get("version", 0)
+
+    def write_version(self, version: int):
+        info = {"version": version, "stamp": file_stamp(self.file_path)}
+        write_atomic(self.version_path, lambda f: json.dump(info, f))
+
+    def open_snapshot(self):
+        # the snapshot if it is of the same version as the data files
+        version = self.read_version()
+        if not version:
+            return None
+        try:
+            snapshot = Snapshot(self.snapshot_path)
+        except (OSError, ValueError, struct_error):
+            return None
+        if snapshot.version != version \
+                or snapshot.key_type != self.SNAPSHOT_KEYS \
+                or len(snapshot.columns) != self.SNAPSHOT_COLUMNS:
+            return None
+        return snapshot
+
+    def write_snapshot(self, items: list, version: int):
+        # the snapshot is only a faster copy of the data files: if it cannot
+        # be written (a value it cannot keep, the file is in use on
+        # Windows), the old one is ignored for its older version
+        try:
+            # the hashes of the entries still in the snapshot are kept
+            hashes = [
+                self.snapshot.record(value.index)[1]
+                if isinstance(value, Mapped) else None
+                for _, value in items
+            ]
+            rows = sorted(
+                self.snapshot_row(
+                    key, entry, entry_hash(entry) if digest is None else digest
+                )
+                for (key, entry), digest in zip(self.to_entries(items), hashes)
+            )
+            write_atomic(
+                self.snapshot_path,
+                lambda f: dump_snapshot(
+                    f,
+                    self.SNAPSHOT_KEYS,
+                    version,
+                    [record for _, record, _ in rows],
+                    [list(column) for column in zip(*(c for *_, c in rows))]
+                    or [[]] * self.SNAPSHOT_COLUMNS,
+                ),
+                binary=True,
+            )
+        except (OSError, ValueError):
+            return
+        self.snapshot_version = version
+
+    def read_items(self):
+        # (key, value) of the entries made so far (all of them for a dict),
+        # the others are searched in the snapshot columns
+        return self.data.cache.items() if self.snapshot else self.data.items()
+
+    def scan(self, column: int, query: str, match) -> list:
+        # keys of the entries whose value matches (the column contains the
+        # query for the entries not made yet)
+        keys = [key for key, value in list(self.read_items()) if match(value)]
+        if self.snapshot:
+            keys.extend(self.data.scan(column, query.encode("utf-8")))
+        return keys
+
+    def data_items(self) -> list:
+        # (key, value) references of all the entries, see to_entries()
+        if self.snapshot:
+            return self.data.refs()
+        return list(self.data.items())
+
+    def data_ref(self, key):
+        # the entry of the key, or its Mapped reference if it is not made yet
+        if self.snapshot and key not in self.data.cache:
+            i = self.data.find(key)
+            if i is not None:
+                return Mapped(i)
+        return self.data[key]
+
+    def read_entries(self, f):
+        for key, value in load_entries(f):
+            self.synced[key] = entry_hash(value)
+            yield key, value
+
+    def load_file(self):
+        # the lock is held: the shards are read on a process pool
+        manifest = self.read_manifest()
+        self.use_manifest(manifest)
+        self.synced = {}
+        self.snapshot = self.open_snapshot()
+        if self.snapshot:
+            self.version = self.snapshot_version = self.snapshot.version
+            self.synced = SnapshotData(
+                self.snapshot,
+                lambda i: self.snapshot.record(i)[1],
+                key=str,
+            )
+            self.from_snapshot(self.snapshot)
+        elif manifest:
+            paths = self.data_paths()
+            workers = min(len(paths), os.cpu_count() or 1)
+            if workers > 1:
+                # spawn: the books are loaded on the threads of LazyBook and
+                # forking a multithreaded process can deadlock the workers
+                context = get_context("spawn")
+                with ProcessPoolExecutor(workers, mp_context=context) as pool:
+                    shards = list(pool.map(load_shard, paths))
+            else:
+                shards = map(load_shard, paths)
+            for entries, hashes in shards:
+                self.synced.update(hashes)
+                self.from_entries(entries)
+        elif self.file_path.exists():
+            with open(self.file_path, "r", encoding="utf-8") as f:
+                self.from_entries(self.read_entries(f))
+            # the next save goes on from the last known version
+            self.version = self.version_info().get("version", 0)
+        if not self.snapshot and self.read_version():
+            # no snapshot or an older one
+            self.write_snapshot(self.data_items(), self.version)
+        self.stamps = self.file_stamps()
+        self.dirty = set()
+
+    def is_changed(self) -> bool:
+        # saved by another session since the last read or write
+        if self.manifest_path().exists() != self.sharded:
+            return True
+        return self.file_stamps() != self.stamps
+
+    def merge(self) -> int:
+        # the lock is held: applies the entries changed by another session,
+        # returns their number, the entries changed on both sides stay as
+        # they are here and the other versions go to the .conflicts file
+        manifest = self.read_manifest()
+        if not manifest and not self.file_path.exists():
+            return 0
+        self.use_manifest(manifest)
+        stamps = self.file_stamps()
+        changed = {
+            path for path in self.data_paths()
+            if stamps[path] != self.stamps.get(path)
+        }
+        if not changed:
+            self.stamps = stamps
+            return 0
+        # the entries of the other shards are as they were
+        unchanged = {
+            shard for shard in self.shards
+            if self.shard_path(shard) not in changed
+        } if self.sharded else set()
+        flag = self._save_changes
+        merged = 0
+        seen = set()
+        conflicts = []
+        for path in changed:
+            if stamps[path] is None:
+                continue
+            with open(path, "r", encoding="utf-8") as f:
+                for key, value in load_entries(f):
+                    seen.add(key)
+                    digest = entry_hash(value)
+                    if digest == self.synced.get(key):
+                        continue
+                    self.synced[key] = digest
+                    if key in self.dirty:
+                        local = self.entry(key)
+                        if local is None or entry_hash(local) != digest:
+                            conflicts.append((key, value))
+                        continue
+                    self.apply_entry(key, value)
+                    self.dirty.discard(key)
+                    merged += 1
+        # deleted in the other session
+        for key in list(self.synced):
+            if key in seen or unchanged and self.shard_of(key) in unchanged:
+                continue
+            del self.synced[key]
+            if key in self.dirty:
+                if self.entry(key) is not None:
+                    conflicts.append((key, None))
+                continue
+            self.remove_entry(key)
+            self.dirty.discard(key)
+            merged += 1
+        self.stamps = stamps
+        if not self.sharded:
+            self.version = max(
+                self.version, self.version_info().get("version", 0)
+            )
+        self._save_changes = flag
+        if conflicts:
+            self.save_conflicts(conflicts)
+        return merged
+
+    def save_conflicts(self, conflicts: list):
+        self.conflicts.extend(key for key, _ in conflicts)
+        conflict_path = self.file_path.with_name(
+            self.file_path.name + ".conflicts"
+        )
+        with open(conflict_path, "a", encoding="utf-8") as f:
+            for key, value in conflicts:
+                f.write(encode({
+                    "time": datetime.now().isoformat(timespec="seconds"),
+                    "key": key,
+                    "theirs": value,
+                }) + "\n")
+
+    def sync(self) -> int:
+        # picks up the changes made by another session since the last
+        # read or write, returns the number of merged entries
+        if not self.is_changed():
+            return 0
+        with self.save_lock, locked(self.file_path):
+            return self.merge()
+
+    def write_shards(self, items: list, dirty: set, version: int):
+        self.shard_dir.mkdir(exist_ok=True)
+        by_shard = {self.shard_of(key): [] for key in dirty}
+        for key, value in items:
+            shard = self.shard_of(key)
+            if shard in by_shard:
+                by_shard[shard].append((key, value))
+        for shard, shard_items in by_shard.items():
+            if shard_items:
+                write_atomic(
+                    self.shard_path(shard),
+                    lambda f: dump_entries(f, self.to_entries(shard_items)),
+                )
+            else:
+                self.shard_path(shard).unlink(missing_ok=True)
+        self.shards = sorted(
+            (set(self.shards) | {s for s, i in by_shard.items() if i})
+            - {s for s, i in by_shard.items() if not i}
+        )
+        manifest = {
+            "version": version,
+            "shards": self.shards,
+            "count": self.shard_count,
+            "size": self.shard_size,
+        }
+        write_atomic(self.manifest_path(), lambda f: json.dump(manifest, f))
+
+    def save(self):
+        # the lock is held
+        changes = self.changes
+        items = self.data_items()
+        dirty = self.dirty
+        self.dirty = set()
+        version = self.version + 1
+        try:
+            if self.sharded:
+                self.write_shards(items, dirty, version)
+            else:
+                write_atomic(
+                    self.file_path,
+                    lambda f: dump_entries(f, self.to_entries(items)),
+                )
+                self.write_version(version)
+        except BaseException:
+            self.dirty |= dirty
+            raise
+        self.version = version
+        self.stamps = self.file_stamps()
+        for key in dirty:
+            entry = self.entry(key)
+            if entry is None:
+                self.synced.pop(key, None)
+            else:
+                self.synced[key] = entry_hash(entry)
+        if changes == self.changes:
+            self._save_changes = False
+
+    def write_to_file(self, merge: bool = True) -> bool:
+        # may run on the autosave thread: the list of entries is taken
+        # first (only references, the entries are converted one by one while
+        # writing) and the flag is cleared only if nothing has changed since;
+        # without merge a file changed by another session is not written
+        # (False), merging changes the book under the main thread's feet
+        with self.save_lock, locked(self.file_path):
+            if not self._save_changes:
+                return True
+            if self.is_changed():
+                if not merge:
+                    return False
+                self.merge()
+            self.save()
+        return True
+
+    def refresh_snapshot(self):
+        # at the end of a session: the snapshot of the saved version, unless
+        # it is current or another session has saved the files since
+        with self.save_lock, locked(self.file_path):
+            if self.snapshot_version != self.version \
+                    and not self.is_changed() and self.read_version():
+                self.write_snapshot(self.data_items(), self.version)
+
+    def set_storage(self, sharded: bool, count: int = SHARD_COUNT):
+        # converts the book between the single file and the shards
+        with self.save_lock, locked(self.file_path):
+            self.merge()
+            self.sharded = sharded
+            self.shards = []
+            self.shard_count = count
+            self.dirty |= {str(k) for k in self.data}
+            self.save()
+            if sharded:
+                self.file_path.unlink(missing_ok=True)
+                self.version_path.unlink(missing_ok=True)
+                keep = set(self.file_stamps())
+                for path in self.shard_dir.glob("*.json"):
+                    if path not in keep:
+                        path.unlink()
+            elif self.shard_dir.exists():
+                rmtree(self.shard_dir)
+            self.write_snapshot(self.data_items(), self.version)
+
+
+class AddressBook(UserDict, BookFile):
+    SNAPSHOT_KEYS = TEXT_KEYS
+    SNAPSHOT_COLUMNS = 4
+
+    def __init__(self, filename=FILE_ADDRESSBOOK, autosaver=None):
+        super().__init__()
+        # exact phone / lower case e-mail -> names of the contacts
+        self._phones: dict[str, set] = {}
+        self._emails: dict[str, set] = {}
+        # reversed domain ("com.example.mail") -> names and the sorted keys,
+        # a domain and its subdomains are next to each other
+        self._domains: dict[str, set] = {}
+        self._domain_keys: list[str] = []
+        # False until the indexes of a snapshot book are built
+        self.indexed = True
+        # optional parallel.ParallelSearch, see use_parallel_search()
+        self.scanner = None
+        self.init_file(filename, autosaver)
         self.read_from_file()
 
+    def build_indexes(self):
+        # from the snapshot columns, on first use: every change of a phone
+        # or an e-mail goes through the indexes, so until then the
+        # snapshot values of the entries are the indexed ones
+        if self.indexed:
+            return
+        self.indexed = True
+        snapshot = self.snapshot
+        for i, name in self.data.mapped(unread=False):
+            phones = snapshot.value(PHONE_COLUMN, i)
+            for phone in phones.split("!") if phones else ():
+                self._phones.setdefault(phone, set()).add(name)
+            email = snapshot.value(EMAIL_COLUMN, i).lower()
+            if email:
+                self._emails.setdefault(email, set()).add(name)
+                domain = reverse_domain(email)
+                self._domains.setdefault(domain, set()).add(name)
+        self._domain_keys = sorted(self._domains)
+
+    @property
+    def phones(self) -> dict:
+        self.build_indexes()
+        return self._phones
+
+    @property
+    def emails(self) -> dict:
+        self.build_indexes()
+        return self._emails
+
+    @property
+    def domains(self) -> dict:
+        self.build_indexes()
+        return self._domains
+
+    @property
+    def domain_keys(self) -> list:
+        self.build_indexes()
+        return self._domain_keys
+
+    def use_parallel_search(self, workers: int = None):
+        from parallel import ParallelSearch
+
+        self.scanner = ParallelSearch(self, workers)
+
+    def touch(self, record: Record):
+        # the record has changed: it is to be saved (and merged with the
+        # other sessions), the parallel search columns are stale
+        self.dirty.add(record.name.value)
+        if self.scanner:
+            self.scanner.touch(record.name.value)
+
+    def index_add(self, index: dict, key: str, record: Record):
+        self.touch(record)
+        index.setdefault(key, set()).add(record.name.value)
+
+    def index_remove(self, index: dict, key: str, record: Record):
+        self.touch(record)
+        names = index.get(key)
+        if names:
+            names.discard(record.name.value)
+            if not names:
+                del index[key]
+
+    def index_email(self, record: Record):
+        if record.email:
+            email = record.email.value.lower()
+            self.index_add(self.emails, email, record)
+            domain = reverse_domain(email)
+            if domain not in self.domains:
+                insort(self.domain_keys, domain)
+            self.index_add(self.domains, domain, record)
+
+    def unindex_email(self, record: Record):
+        if record.email:
+            email = record.email.value.lower()
+            self.index_remove(self.emails, email, record)
+            domain = reverse_domain(email)
+            self.index_remove(self.domains, domain, record)
+            if domain not in self.domains:
+                i = bisect_left(self.domain_keys, domain)
+                if i < len(self.domain_keys) and self.domain_keys[i] == domain:
+                    del self.domain_keys[i]
+
+    def link(self, record: Record):
+        self.data[record.name.value] = record
+        record.book = self
+        self.touch(record)
+        for phone in record.phone:
+            self.index_add(self.phones, phone.value, record)
+        self.index_email(record)
+
     def add_record(self, record: Record, print_msg=True):
         if record.name.value in self.data:
             raise KeyError(f"ERROR: cannot duplicate '{record.name.value}'")
-        self.data[record.name.value] = record
+        self.link(record)
         self.save_changes = True
         if print_msg:
             print(f"\nContact '{record.name.value}' successfully added.\n")
 
     def delete_record(self, name):
         if name in self.data:
-            del self.data[name]
+            record = self.data.pop(name)
+            self.touch(record)
+            for phone in record.phone:
+                self.index_remove(self.phones, phone.value, record)
+            self.unindex_email(record)
+            record.book = None
             self.save_changes = True
 
+    def find_phone(self, phone: str) -> list[str]:
+        return sorted(self.phones.get(phone, ()))
+
+    def find_email(self, email: str) -> list[str]:
+        return sorted(self.emails.get(email.lower(), ()))
+
+    def search_email(self, search_str: str) -> list[str]:
+        # "@example.com" - the domain and its subdomains,
+        # "name@example.com" - the address, anything else - a part of it
+        search_str = search_str.strip().lower()
+        if search_str.startswith("@"):
+            domain = reverse_domain(search_str)
+            names = set()
+            i = bisect_left(self.domain_keys, domain)
+            while i < len(self.domain_keys):
+                key = self.domain_keys[i]
+                if key != domain and not key.startswith(domain + "."):
+                    break
+                names.update(self.domains[key])
+                i += 1
+            return sorted(names)
+        if "@" in search_str and search_str in self.emails:
+            return self.find_email(search_str)
+        return sorted(
+            name for email, names in self.emails.items()
+            if search_str in email for name in names
+        )
+
+    def find_duplicates(self) -> list[dict]:
+        # contacts sharing a phone or an e-mail, directly or through others
+        parent = {}
+
+        def root(name):
+            while parent.setdefault(name, name) != name:
+                parent[name] = parent[parent[name]]
+                name = parent[name]
+            return name
+
+        shared = [
+            (key, names)
+            for index in (self.phones, self.emails)
+            for key, names in index.items() if len(names) > 1
+        ]
+        for key, names in shared:
+            first, *others = names
+            for name in others:
+                parent[root(name)] = root(first)
+        clusters: dict = {}
+        for key, names in shared:
+            cluster = clusters.setdefault(
+                root(next(iter(names))), {"names": set(), "shared": []}
+            )
+            cluster["names"].update(names)
+            cluster["shared"].append(key)
+        return sorted(
+            (
+                {"names": sorted(c["names"]), "shared": sorted(c["shared"])}
+                for c in clusters.values()
+            ),
+            key=lambda c: c["names"],
+        )
+
     def __str__(self) -> str:
         return RECORD_HEADER + "\n".join(str(v) for v in self.values())
 
     def search_birthday(self, days: int):
         while days < 0:
             days += 365
-        return sorted(
-            name for name, record in self.data.items()
+        names = [
+            name for name, record in self.read_items()
             if record.birthday and days in record.birthday
-        )
+        ]
+        if self.snapshot:
+            # the dates of the records column, each one is checked once
+            found = {}
+            indexes = []
+            for i in range(self.snapshot.count):
+                birthday = self.snapshot.record(i)[2]
+                if birthday not in found:
+                    found[birthday] = bool(birthday) and days in \
+                        Birthday.from_datetime(datetime.fromordinal(birthday))
+                if found[birthday]:
+                    indexes.append(i)
+            names.extend(self.data.unread_keys(indexes))
+        return sorted(names)
 
     def search_all(self, search_str):
+        if self.scanner is None and not self.snapshot \
+                and len(self.data) >= PARALLEL_SEARCH_MIN:
+            self.use_parallel_search()
+        if search_str and self.scanner:
+            return self.scanner.search_all(search_str)
         if search_str:
-            return sorted(
-                name for name, record in self.data.items()
-                if search_str in record
+            names = self.scan(
+                LOWER_NAME_COLUMN, search_str.lower(),
+                lambda record: search_str in record,
             )
+            if search_str.isdigit() and self.snapshot:
+                names.extend(self.data.scan(
+                    PHONE_COLUMN, search_str.encode("utf-8")
+                ))
+            return sorted(set(names))
         else:
             return sorted(self.data.keys())
 
     def search_name(self, search_str):
-        return sorted(name for name in self.data.keys() if search_str in name)
+        return sorted(self.scan(
+            NAME_COLUMN, search_str,
+            lambda record: search_str in record.name.value,
+        ))
 
     def search_phone(self, search_str):
+        if len(search_str) == 12 and search_str.isdigit():
+            # a whole number, no need to look through all the contacts
+            return self.find_phone(search_str)
         if search_str.isdigit():
-            return sorted(
-                name for name, record in self.data.items()
-                if search_str in "!".join(p.value for p in record.phone)
-            )
+            return sorted(self.scan(
+                PHONE_COLUMN, search_str,
+                lambda record: search_str in "!".join(
+                    p.value for p in record.phone
+                ),
+            ))
         else:
             return []
 
     def from_dict(self, source_dict: dict):
-        for k, v in source_dict.items():
-            self.data[k] = Record(
-                Name(v["name"]),
-                birthday=Birthday(v["birthday"]) if v["birthday"] else None,
-                email=Email(v["email"]) if v["email"] else None,
-                phone=[Phone(x) for x in v["phone"]],
-            )
+        self.from_entries(source_dict.items())
+
+    def from_entries(self, entries):
+        # a bulk load: the records are not marked as changed (see link()) and
+        # the domain keys are sorted once, an insort per domain is quadratic
+        phones, emails, domains = self._phones, self._emails, self._domains
+        for k, v in entries:
+            record = make_record(v)
+            name = record.name.value
+            self.data[name] = record
+            record.book = self
+            if self.scanner:
+                self.scanner.touch(name)
+            for phone in record.phone:
+                phones.setdefault(phone.value, set()).add(name)
+            if record.email:
+                email = record.email.value.lower()
+                emails.setdefault(email, set()).add(name)
+                domains.setdefault(reverse_domain(email), set()).add(name)
+        self._domain_keys = sorted(domains)
+
+    def from_snapshot(self, snapshot):
+        self.data = SnapshotData(snapshot, self.load_record)
+        self.indexed = False
+
+    def load_record(self, i: int) -> Record:
+        record = make_record(self.snapshot_entry(i))
+        record.book = self
+        return record
+
+    def snapshot_entry(self, i: int) -> dict:
+        snapshot = self.snapshot
+        phones = snapshot.value(PHONE_COLUMN, i)
+        return {
+            "name": snapshot.value(NAME_COLUMN, i),
+            "birthday": ordinal_date(snapshot.record(i)[2]),
+            "email": snapshot.value(EMAIL_COLUMN, i) or None,
+            "phone": phones.split("!") if phones else [],
+        }
+
+    def snapshot_row(self, key: str, entry: dict, digest: int) -> tuple:
+        return key, (0, digest, date_ordinal(entry["birthday"])), (
+            entry["name"],
+            entry["name"].lower(),
+            entry["email"] or "",
+            "!".join(entry["phone"]),
+        )
 
     def read_from_file(self):
         self.save_changes = False
-        if self.file_path.exists():
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                self.from_dict(json.load(f))
+        with locked(self.file_path, shared=True):
+            self.load_file()
+
+    def shard_of(self, key) -> int:
+        return crc32(key.encode("utf-8")) % self.shard_count
+
+    def entry(self, key: str):
+        # the entry as it would be saved, None if there is no such contact
+        if key not in self.data:
+            return None
+        return next(self.to_entries([(key, self.data[key])]))[1]
+
+    def apply_entry(self, key: str, value: dict):
+        if key in self.data:
+            self.delete_record(key)
+        self.link(make_record(value))
+
+    def remove_entry(self, key: str):
+        self.delete_record(key)
 
     def to_dict(self) -> dict:
-        return {
-            k: {
+        return dict(self.to_entries())
+
+    def to_entries(self, items=None):
+        # list() copies the items at once, so the main thread
+        # may go on changing the book
+        for k, v in self.data_items() if items is None else items:
+            if isinstance(v, Mapped):
+                yield k, self.snapshot_entry(v.index)
+                continue
+            yield k, {
                 "name": v.name.value,
                 "birthday": v.birthday.value.strftime(DATE_FORMAT)
                 if v.birthday else None,
                 "email": v.email.value if v.email else None,
                 "phone": [p.value for p in v.phone],
             }
-            for k, v in self.data.items()
-        }
-
-    def write_to_file(self):
-        if self.save_changes:
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                json.dump(self.to_dict(), f)
-                self.save_changes = False
 
 
 class HashTag(Field):
@@ -238,12 +1106,30 @@ class HashTag(Field):
             raise ValueError(f"'{value}' is not a hashtag")
 
 
-class NoteBook():
-    def __init__(self, filename=FILE_NOTEBOOK):
-        # super().__init__()
-        self.file_path = Path(filename)
+class NoteBook(BookFile):
+    SNAPSHOT_KEYS = NUMBER_KEYS
+    SNAPSHOT_COLUMNS = 3
+
+    def __init__(self, filename=FILE_NOTEBOOK, autosaver=None):
+        self.init_file(filename, autosaver)
         self.read_from_file()
 
+    @property
+    def tags(self) -> dict:
+        # the tags of a snapshot book are collected on first use, see
+        # AddressBook.build_indexes()
+        if self._tags is None:
+            self._tags = {}
+            for i, note_id in self.data.mapped(unread=False):
+                tags = self.snapshot.value(TAGS_COLUMN, i)
+                for tag in tags.split(TAG_SEPARATOR) if tags else ("#",):
+                    self._tags.setdefault(tag, []).append(note_id)
+        return self._tags
+
+    @tags.setter
+    def tags(self, tags: dict):
+        self._tags = tags
+
     def add_id_to_tags(self, note_id, tags):
         self.save_changes = True
         if tags:
@@ -261,6 +1147,7 @@ class NoteBook():
             self.tags.get("#").remove(note_id)
 
     def delete_tag(self, note_id, tag):
+        self.touch(note_id)
         self.save_changes = True
         self.data[note_id]['tags'].remove(tag)
         if len(self.tags[tag]) == 1:
@@ -276,7 +1163,10 @@ class NoteBook():
             self.add_id_to_tags(note_id, note['tags'])
 
     def from_dict(self, source_dict):
-        for k, v in source_dict.items():
+        self.from_entries(source_dict.items())
+
+    def from_entries(self, entries):
+        for k, v in entries:
             self.data[int(k)] = {
                 "text": v['text'],
                 "created": v['created'],
@@ -286,22 +1176,79 @@ class NoteBook():
     def read_from_file(self):
         self.data: dict = {}
         self.max_id = 0
+        with locked(self.file_path, shared=True):
+            try:
+                self.load_file()
+            except json.decoder.JSONDecodeError:
+                print(f"ERROR: File {self.file_path} could not be decoded")
+        if not self.snapshot:
+            if self.data:
+                self.max_id = max(self.data.keys()) + 1
+            self.tags_scan()
         self.save_changes = False
-        if self.file_path.exists():
-            with open(self.file_path, "r", encoding="utf-8") as f:
-                try:
-                    self.from_dict(json.load(f))
-                except json.decoder.JSONDecodeError:
-                    print(f"ERROR: File {self.file_path} could not be decoded")
-        if self.data:
-            self.max_id = max(self.data.keys()) + 1
-        self.tags_scan()
-
-    def write_to_file(self):
-        if self.save_changes:
-            with open(self.file_path, "w", encoding="utf-8") as f:
-                json.dump(self.data, f)
-                self.save_changes = False
+        self.dirty = set()
+
+    def from_snapshot(self, snapshot):
+        self.data = SnapshotData(snapshot, self.snapshot_entry)
+        # the ids are sorted
+        self.max_id = snapshot.key(snapshot.count - 1) + 1 \
+            if snapshot.count else 0
+        self.tags = None
+
+    def snapshot_entry(self, i: int) -> dict:
+        snapshot = self.snapshot
+        tags = snapshot.value(TAGS_COLUMN, i)
+        return {
+            "text": snapshot.value(TEXT_COLUMN, i),
+            "created": ordinal_date(snapshot.record(i)[2]),
+            "tags": tags.split(TAG_SEPARATOR) if tags else [],
+        }
+
+    def snapshot_row(self, key, entry: dict, digest: int) -> tuple:
+        note_id = int(key)
+        return note_id, (note_id, digest, date_ordinal(entry["created"])), (
+            entry["text"],
+            entry["text"].lower(),
+            TAG_SEPARATOR.join(entry["tags"]),
+        )
+
+    def shard_of(self, key) -> int:
+        return int(key) // self.shard_size
+
+    def entry(self, key: str):
+        # the entry as it would be saved, None if there is no such note
+        note_id = int(key)
+        if note_id not in self.data:
+            return None
+        return next(self.to_entries([(note_id, self.data[note_id])]))[1]
+
+    def apply_entry(self, key: str, value: dict):
+        note_id = int(key)
+        if note_id in self.data:
+            self.delete_note(note_id)
+        self.from_entries([(key, value)])
+        self.add_id_to_tags(note_id, self.data[note_id]["tags"])
+        self.max_id = max(self.max_id, note_id + 1)
+
+    def remove_entry(self, key: str):
+        self.delete_note(int(key))
+
+    def touch(self, note_id: int):
+        self.dirty.add(str(note_id))
+
+    def to_dict(self) -> dict:
+        return dict(self.to_entries())
+
+    def to_entries(self, items=None):
+        for k, v in self.data_items() if items is None else items:
+            if isinstance(v, Mapped):
+                yield k, self.snapshot_entry(v.index)
+                continue
+            yield k, {
+                "text": v["text"],
+                "created": v["created"],
+                "tags": list(v["tags"]),
+            }
 
     def add_note(self, text, tags: list[str] = []):
         self.data[self.max_id] = {
@@ -310,6 +1257,7 @@ class NoteBook():
             "tags": tags
         }
         self.add_id_to_tags(self.max_id, tags)
+        self.touch(self.max_id)
         self.max_id += 1
         self.save_changes = True
 
@@ -320,6 +1268,7 @@ class NoteBook():
                     raise KeyError(f"Cannot duplicate tag '{tag}'")
             else:
                 self.tags["#"].remove(note_id)
+            self.touch(note_id)
             self.save_changes = True
             self.data[note_id]['tags'].append(tag)
             self.tags.setdefault(tag, []).append(note_id)
@@ -329,17 +1278,19 @@ class NoteBook():
     def delete_note(self, note_id):
         self.delete_id_from_tags(note_id, self.data[note_id]['tags'])
         del self.data[note_id]
+        self.touch(note_id)
         self.save_changes = True
 
     def update(self, note_id, text):
+        self.touch(note_id)
         self.save_changes = True
-        self.data
+        self.data[note_id]['text'] = text
 
     def search_text(self, search_str):
-        return [
-            note_id for note_id, note in self.data.items()
-            if search_str.lower() in note['text'].lower()
-        ]
+        return self.scan(
+            LOWER_TEXT_COLUMN, search_str.lower(),
+            lambda note: search_str.lower() in note['text'].lower(),
+        )
 
     def search_tag(self, search_str):
         if search_str in ("", "#"):
@@ -357,10 +1308,7 @@ class NoteBook():
         for tag, note_id_list in self.tags.items():
             if search_str.lower() in tag.lower():
                 result_set.update(note_id_list)
-        search_set = set(self.data.keys()) - result_set
-        for note_id in search_set:
-            if search_str.lower() in self.data[note_id]['text'].lower():
-                result_set.add(note_id)
+        result_set.update(self.search_text(search_str))
         return sorted(result_set)
 
     def show_note(self, note_id):
@@ -385,3 +1333,51 @@ class NoteBook():
 
     def __contains__(self, note_id):
         return note_id in self.data
+
+
+class LazyBook:
+    # loads a book on a background thread and stands in for it,
+    # any use of the book waits until the loading is finished
+    def __init__(self, book_class, *args):
+        object.__setattr__(self, "_book", None)
+        object.__setattr__(self, "_error", None)
+        thread = Thread(target=self._load, args=(book_class, *args))
+        thread.daemon = True
+        object.__setattr__(self, "_thread", thread)
+        thread.start()
+
+    def _load(self, book_class, *args):
+        try:
+            object.__setattr__(self, "_book", book_class(*args))
+        except Exception as e:
+            object.__setattr__(self, "_error", e)
+
+    def is_loaded(self) -> bool:
+        return not self._thread.is_alive()
+
+    def wait(self):
+        self._thread.join()
+        if self._error:
+            raise self._error
+        return self._book
+
+    def __getattr__(self, name):
+        return getattr(self.wait(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.wait(), name, value)
+
+    def __getitem__(self, key):
+        return self.wait()[key]
+
+    def __contains__(self, key):
+        return key in self.wait()
+
+    def __len__(self):
+        return len(self.wait())
+
+    def __iter__(self):
+        return iter(self.wait())
+
+    def __str__(self):
+        return str(self.wait())
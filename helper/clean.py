@@ -1,8 +1,29 @@
 from re import sub
+from os import fsync, fstat, replace
+from errno import EXDEV
+from time import sleep, time, perf_counter
+from datetime import datetime
+from mmap import mmap, ACCESS_READ
+from json import dumps, loads
+from threading import local
+from functools import lru_cache
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from shutil import unpack_archive, ReadError
-from hashlib import md5
+from shutil import unpack_archive, ReadError, copystat, copyfileobj, move
+from tempfile import mkstemp
+from hashlib import new as new_hash
 
+try:
+    from os import copy_file_range
+except ImportError:  # not Linux or Python < 3.8
+    copy_file_range = None
+try:
+    from os import sendfile
+except ImportError:  # Windows
+    sendfile = None
+
+# default sort folders, extended by the rules file
 FOLDERS = {
     "images": ("JPEG", "PNG", "JPG", "SVG"),
     "video": ("AVI", "MP4", "MOV", "MKV"),
@@ -23,13 +44,91 @@ for c, l in zip(CYR, TRN):
     trn_dict[ord(c)] = l
     trn_dict[ord(c.upper())] = l.upper()
 
-# list of archives to unpack
-archives = []
-# counters
-total: dict = {}
-counters = [0, 0, 0, 0]
+# user rules: {"categories": {"books": ["EPUB", "FB2"]}, "sniff": true}
+RULES_FILE = Path.home() / ".bot-helper-rules.json"
+# file signatures for files with unknown extensions: (offset, bytes, folder)
+SNIFF_SIZE = 264
+SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n", "images"),
+    (0, b"\xff\xd8\xff", "images"),
+    (0, b"%PDF-", "documents"),
+    (0, b"ID3", "audio"),
+    (0, b"OggS", "audio"),
+    (0, b"#!AMR", "audio"),
+    (8, b"WAVE", "audio"),
+    (8, b"AVI ", "video"),
+    # ISO media files: the brand after "ftyp" tells the kind
+    (4, b"ftypM4A ", "audio"),
+    (4, b"ftypM4B ", "audio"),
+    (4, b"ftypheic", "images"),
+    (4, b"ftypheix", "images"),
+    (4, b"ftypmif1", "images"),
+    (4, b"ftypmsf1", "images"),
+    (4, b"ftypavif", "images"),
+    (4, b"ftypisom", "video"),
+    (4, b"ftypiso2", "video"),
+    (4, b"ftypmp41", "video"),
+    (4, b"ftypmp42", "video"),
+    (4, b"ftypavc1", "video"),
+    (4, b"ftypM4V ", "video"),
+    (4, b"ftypqt  ", "video"),
+    (4, b"ftyp3gp", "video"),
+    (0, b"\x1a\x45\xdf\xa3", "video"),
+    # zip containers with a "mimetype" first entry (OpenDocument, EPUB)
+    (30, b"mimetypeapplication/epub+zip", "documents"),
+    (30, b"mimetypeapplication/vnd.oasis.opendocument", "documents"),
+    (0, b"PK\x03\x04", "archives"),
+    (0, b"\x1f\x8b", "archives"),
+    (257, b"ustar", "archives"),
+)
+
+# "md5" keeps hashes compatible, "blake2b" is faster on 64-bit machines
+HASH_ALGORITHM = "md5"
+HASH_ALGORITHMS = ("md5", "blake2b")
+HASH_BUF_SIZE = 128 * 1024
+# files from this size on are hashed through mmap
+MMAP_SIZE = 64 * 1024 * 1024
+# files from this size on are hashed on worker threads
+THREAD_SIZE = 4 * 1024 * 1024
+# worker threads for hashing and sniffing
+HASH_WORKERS = 4
+
+# progress journal of an interrupted sort (kept in the sorted folder)
+JOURNAL = ".sort-journal"
+# number of steps applied between two journal records
+BATCH_SIZE = 100
+# processed entries of a watched folder
+CHECKPOINT = ".sort-checkpoint"
+WATCH_INTERVAL = 5.0
+# files modified less than that many seconds ago may be still written
+SETTLE_TIME = 2.0
+# a move between two file systems copies the file: in the kernel if it
+# can (a reflink cannot cross file systems), else through user space
+COPY_CHUNK = 8 * 1024 * 1024
+# step reasons (besides the sort folder names)
+DUPLICATE_NAME = "duplicate name"
+DUPLICATE_FILE = "duplicate file"
+UNKNOWN_EXT = "unknown extension"
+EMPTY_FOLDER = "empty folder"
+NEW_FOLDER = "sort folder"
+MAKE_ROOM = "make room for folder"
+DISPLACED = "file in place of folder"
+NORMALIZE = "normalize name"
+ARCHIVE = "archive"
+
+# one planned change: action is one of
+# "mkdir", "move", "rename", "delete", "keep", "rmdir", "unpack"
+Step = namedtuple("Step", "action source destination reason")
+
+# number of folders listed in the report as the slowest ones
+SLOWEST_FOLDERS = 5
+
+# reusable read buffer (one per thread)
+hash_buffer = local()
+pool = None
 
 
+@lru_cache(maxsize=4096)
 def normalize(string: str) -> str:
     return sub(r"\W", "_", string.translate(trn_dict))
 
@@ -38,155 +137,813 @@ def plural(number: int):
     return number, " was" if number == 1 else "s were"
 
 
-def calc_hash(file_path: Path) -> str:
-    BUF_SIZE = 128 * 1024
-    md = md5()
+def calc_hash(
+    file_path: Path, algorithm: str = HASH_ALGORITHM, use_mmap=None
+) -> str:
+    md = new_hash(algorithm)
     if file_path.is_file():
-        with open(file_path, "rb") as f:
-            while True:
-                data = f.read(BUF_SIZE)
-                if not data:
-                    break
-                md.update(data)
+        with open(file_path, "rb", buffering=0) as f:
+            size = fstat(f.fileno()).st_size
+            if use_mmap is None:
+                use_mmap = size >= MMAP_SIZE
+            if use_mmap and size:
+                with mmap(f.fileno(), 0, access=ACCESS_READ) as data:
+                    md.update(data)
+            else:
+                if not hasattr(hash_buffer, "data"):
+                    hash_buffer.data = bytearray(HASH_BUF_SIZE)
+                    hash_buffer.view = memoryview(hash_buffer.data)
+                while n := f.readinto(hash_buffer.data):
+                    md.update(hash_buffer.view[:n])
     return md.hexdigest()
 
 
-def get_unique_name(old_file: Path, new_name: str) -> Path:
+def get_pool() -> ThreadPoolExecutor:
+    global pool
+    if pool is None:
+        pool = ThreadPoolExecutor(HASH_WORKERS)
+    return pool
+
+
+def calc_hashes(paths: list[Path], algorithm: str = HASH_ALGORITHM) -> list:
+    # hashlib releases the GIL on big buffers, so big files hashed
+    # on worker threads overlap their reads and digests
+    big = [
+        i for i, p in enumerate(paths)
+        if p.is_file() and p.stat().st_size >= THREAD_SIZE
+    ]
+    if len(big) < 2:
+        return [calc_hash(p, algorithm) for p in paths]
+    futures = {
+        i: get_pool().submit(calc_hash, paths[i], algorithm) for i in big
+    }
+    return [
+        futures[i].result() if i in futures else calc_hash(p, algorithm)
+        for i, p in enumerate(paths)
+    ]
+
+
+class SortRules:
+    def __init__(self, folders: dict = FOLDERS, sniff: bool = False):
+        self.sniff = sniff
+        # extension -> sort folder
+        self.extensions: dict = {}
+        self.folders = set()
+        for category, extensions in folders.items():
+            self.add(category, extensions)
+
+    def add(self, category: str, extensions):
+        self.folders.add(category.lower())
+        for ext in extensions:
+            self.extensions[ext.lstrip(".").upper()] = category
+
+    def get_category(self, file_path: Path):
+        return self.extensions.get(file_path.suffix[1:].upper())
+
+
+def load_rules(file_path: Path = RULES_FILE, sniff=None) -> SortRules:
+    rules = SortRules()
+    if file_path.exists():
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                config = loads(f.read())
+            for category, extensions in config.get("categories", {}).items():
+                rules.add(category, extensions)
+            rules.sniff = bool(config.get("sniff", False))
+        except (ValueError, AttributeError, TypeError) as e:
+            raise ValueError(
+                f"ERROR: '{file_path}' is not a valid rules file ({e})."
+            )
+    if sniff is not None:
+        rules.sniff = sniff
+    return rules
+
+
+def sniff(file_path: Path):
+    try:
+        with open(file_path, "rb") as f:
+            head = f.read(SNIFF_SIZE)
+    except OSError:
+        return None
+    for offset, magic, category in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            return category
+
+
+def sniff_files(files: list, rules: SortRules) -> list:
+    if not rules.sniff or not files:
+        return [None] * len(files)
+    return list(get_pool().map(sniff, files))
+
+
+# results and metrics of one sort run
+class SortReport:
+    def __init__(self, folder: Path):
+        self.folder = folder
+        self.started = datetime.now()
+        # sort folder -> moved files counter
+        self.moved: dict = {}
+        self.renamed = 0
+        self.duplicates = 0
+        self.not_moved = 0
+        self.folders_deleted = 0
+        # unpacked archives
+        self.archives = []
+        self.files = 0
+        self.bytes_hashed = 0
+        self.hash_time = 0.0
+        self.plan_time = 0.0
+        self.execute_time = 0.0
+        self.move_time = 0.0
+        self.fs_calls = 0
+        # moves to another file system: method -> files, bytes and time
+        self.copies: dict = {}
+        self.bytes_copied = 0
+        self.copy_time = 0.0
+        # folder -> time spent on its own entries (subfolders excluded)
+        self.folder_times: dict = {}
+
+    def count(self, step: Step):
+        action, source, _, reason = step
+        if action in ("move", "delete", "keep") and reason not in (
+            MAKE_ROOM, DISPLACED
+        ) or reason == UNKNOWN_EXT:
+            self.files += 1
+        if action == "move" and reason == DUPLICATE_NAME:
+            self.renamed += 1
+        elif action == "move" and reason not in (MAKE_ROOM, DISPLACED):
+            self.moved[reason] = self.moved.get(reason, 0) + 1
+        elif action == "delete":
+            self.duplicates += 1
+        elif reason == UNKNOWN_EXT:
+            self.not_moved += 1
+        elif action == "rmdir":
+            self.folders_deleted += 1
+        elif action == "unpack":
+            self.archives.append(source)
+
+    @property
+    def elapsed(self) -> float:
+        return self.plan_time + self.execute_time
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def cross_device(self) -> int:
+        return sum(self.copies.values())
+
+    @property
+    def copy_speed(self) -> float:
+        # MB/s of the moves to another file system
+        return self.bytes_copied / self.copy_time / 1e6 if self.copy_time \
+            else 0.0
+
+    def slowest_folders(self, number: int = SLOWEST_FOLDERS) -> list:
+        return sorted(
+            self.folder_times.items(), key=lambda x: x[1], reverse=True
+        )[:number]
+
+    def to_dict(self) -> dict:
+        return {
+            "folder": str(self.folder),
+            "started": self.started.isoformat(timespec="seconds"),
+            "files": self.files,
+            "moved": self.moved,
+            "renamed": self.renamed,
+            "duplicates": self.duplicates,
+            "not_moved": self.not_moved,
+            "folders_deleted": self.folders_deleted,
+            "archives": len(self.archives),
+            "elapsed": round(self.elapsed, 6),
+            "files_per_second": round(self.files_per_second, 1),
+            "plan_time": round(self.plan_time, 6),
+            "execute_time": round(self.execute_time, 6),
+            "bytes_hashed": self.bytes_hashed,
+            "hash_time": round(self.hash_time, 6),
+            "move_time": round(self.move_time, 6),
+            "fs_calls": self.fs_calls,
+            "cross_device": self.cross_device,
+            "copies": self.copies,
+            "bytes_copied": self.bytes_copied,
+            "copy_time": round(self.copy_time, 6),
+            "slowest_folders": [
+                [str(f), round(t, 6)] for f, t in self.slowest_folders()
+            ],
+        }
+
+    def to_json(self) -> str:
+        return dumps(self.to_dict(), ensure_ascii=False, indent=2)
+
+    def __str__(self) -> str:
+        lines = []
+        for f, n in self.moved.items():
+            if n and f != "archives":
+                lines.append(
+                    '{} file{} moved to the folder "{}".'.format(*plural(n), f)
+                )
+        if self.archives:
+            lines.append(
+                "{} archive{} unpacked.".format(*plural(len(self.archives)))
+            )
+        if self.renamed:
+            lines.append(
+                "{} file{} renamed (duplicate name).".format(
+                    *plural(self.renamed)
+                )
+            )
+        if self.duplicates:
+            lines.append(
+                "{} duplicate file{} deleted.".format(*plural(self.duplicates))
+            )
+        if self.folders_deleted:
+            lines.append(
+                "{} empty folder{} deleted.".format(
+                    *plural(self.folders_deleted)
+                )
+            )
+        if self.not_moved:
+            lines.append(
+                "{} file{} not moved (check extension).".format(
+                    *plural(self.not_moved)
+                )
+            )
+        if self.copies:
+            lines.append(
+                "{} file{} copied to another file system".format(
+                    *plural(self.cross_device)
+                )
+                + f" ({self.bytes_copied / 1e6:.1f} MB,"
+                + f" {self.copy_speed:.1f} MB/s; "
+                + ", ".join(f"{m}: {n}" for m, n in self.copies.items())
+                + ")."
+            )
+        elif not lines:
+            lines.append("0 files found to process.")
+        return "\n".join(lines)
+
+
+# planned changes plus a view of the folder as if they were applied
+class SortPlan:
+    def __init__(
+        self,
+        folder: Path,
+        algorithm: str = HASH_ALGORITHM,
+        rules=None,
+        report=None,
+    ):
+        self.folder = folder
+        self.algorithm = algorithm
+        self.rules = rules or SortRules()
+        self.report = report or SortReport(folder)
+        self.steps: list[Step] = []
+        # content path -> hash (files are compared more than once)
+        self.hashes: dict = {}
+        # planned path -> path of its content on disk (moves and renames)
+        self.origin: dict = {}
+        # (folder, stem) pairs taken by planned moves
+        self.stems = set()
+        self.dirs = set()
+        self.removed = set()
+        self.archives = []
+
+    def add(self, action, source: Path, destination=None, reason=""):
+        self.steps.append(Step(action, source, destination, reason))
+        if action in ("move", "rename"):
+            self.removed.add(source)
+            self.removed.discard(destination)
+            self.stems.discard((source.parent, source.stem))
+            self.stems.add((destination.parent, destination.stem))
+            self.origin[destination] = self.origin.pop(source, source)
+        elif action in ("delete", "rmdir"):
+            self.removed.add(source)
+            self.origin.pop(source, None)
+        elif action == "mkdir":
+            self.removed.discard(source)
+            self.dirs.add(source)
+
+    def source(self, path: Path) -> Path:
+        return self.origin.get(path, path)
+
+    def exists(self, path: Path) -> bool:
+        if path in self.origin or path in self.dirs:
+            return True
+        if path in self.removed:
+            return False
+        self.report.fs_calls += 1
+        return path.exists()
+
+    def is_dir(self, path: Path) -> bool:
+        if path in self.dirs:
+            return True
+        if path in self.removed:
+            return False
+        self.report.fs_calls += 1
+        return self.source(path).is_dir()
+
+    def is_file(self, path: Path) -> bool:
+        if path in self.dirs or path in self.removed:
+            return False
+        self.report.fs_calls += 1
+        return self.source(path).is_file()
+
+    def size(self, path: Path) -> int:
+        self.report.fs_calls += 1
+        return self.source(path).stat().st_size
+
+    def iterdir(self, folder: Path):
+        self.report.fs_calls += 1
+        return folder.iterdir()
+
+    def same_files(self, path: Path, other: Path) -> bool:
+        paths = [p for p in (path, other) if p not in self.hashes]
+        start = perf_counter()
+        for p, h in zip(paths, calc_hashes(paths, self.algorithm)):
+            self.hashes[p] = h
+            self.report.bytes_hashed += self.size(p)
+        self.report.hash_time += perf_counter() - start
+        return self.hashes[path] == self.hashes[other]
+
+    def stem_exists(self, folder: Path, stem: str) -> bool:
+        if (folder, stem) in self.stems:
+            return True
+        self.report.fs_calls += 1
+        return any(p not in self.removed for p in folder.glob(stem + ".*"))
+
+
+def is_sort_folder(folder: Path, level: int, rules: SortRules) -> bool:
+    return (
+        not level and not folder.suffix and folder.stem.lower() in rules.folders
+    )
+
+
+def get_unique_name(old_file: Path, new_name: str, plan: SortPlan) -> Path:
     new_file = old_file.parent / (new_name + old_file.suffix)
     n = 0
-    while new_file.exists():
+    while plan.exists(new_file):
         n += 1
         file_id = f"_renamed_{n:0>3}_"
         new_file = old_file.parent / (new_name + file_id + old_file.suffix)
     return new_file
 
 
-def process_file(file_path: Path, target: Path):
+def process_file(
+    file_path: Path, target: Path, plan: SortPlan, unpack: bool = True
+):
     filename = normalize(file_path.stem)
     new_file = target / (filename + file_path.suffix)
+    reason = target.stem
     # duplicate name check (extended for archives)
     if (
-        new_file.exists()
+        plan.exists(new_file)
         or target.stem == "archives"
-        and list(target.glob(filename + ".*"))
+        and plan.stem_exists(target, filename)
     ):
-        md5_hash = calc_hash(file_path)
         # cycle to find a unique name (keep checking the hash)
         n = 0
         s = filename
         while (
-            new_file.exists()
+            plan.exists(new_file)
             or target.stem == "archives"
-            and (list(target.glob(s + ".*")) or (target / s).exists())
+            and (plan.stem_exists(target, s) or plan.exists(target / s))
         ):
+            old_file = plan.source(new_file)
             if (
-                new_file.is_file()
-                and new_file.stat().st_size == file_path.stat().st_size
-                and calc_hash(new_file) == md5_hash
+                plan.is_file(new_file)
+                and plan.size(old_file) == plan.size(file_path)
+                and plan.same_files(file_path, old_file)
             ):
                 # delete duplicate file (equal hash)
-                file_path.unlink()
-                counters[1] += 1
+                plan.add("delete", file_path, new_file, DUPLICATE_FILE)
                 return
             else:
                 # filename pattern: "<old filename>_renamed_001_.<ext>"
                 n += 1
                 s = filename + f"_renamed_{n:0>3}_"
                 new_file = target / (s + file_path.suffix)
-        # renamed files counter
-        counters[0] += 1
+        reason = DUPLICATE_NAME
     else:
-        # moved files counters
-        total[target.stem] = total.get(target.stem, 0) + 1
         # check/create sort folder
-        if not target.exists():
-            target.mkdir()
-            print(f"Folder '{target}' has been created.")
+        if not plan.exists(target):
+            plan.add("mkdir", target, reason=NEW_FOLDER)
         # check if there is a file instead of a folder
-        elif target.is_file():
+        elif plan.is_file(target):
             n = 1
             tmp = target.parent / (target.stem + str(n))
-            while tmp.exists():
+            while plan.exists(tmp):
                 n += 1
                 tmp = target.parent / (target.stem + str(n))
-            target.replace(tmp)
-            target.mkdir()
-            tmp.replace(target / target.stem)
-            print(f"Folder '{target}' has been created.")
-            print(f"Warning: the file '{target}' was moved into that folder.")
+            plan.add("move", target, tmp, MAKE_ROOM)
+            plan.add("mkdir", target, reason=NEW_FOLDER)
+            plan.add("move", tmp, target / target.stem, DISPLACED)
     # move the file
-    file_path.replace(new_file)
-    # add to unpack list
-    if target.stem == "archives":
-        archives.append(new_file)
+    plan.add("move", file_path, new_file, reason)
+    # add to unpack list (the archive format is taken from the extension,
+    # so the sniffed ones are left packed)
+    if target.stem == "archives" and unpack:
+        plan.archives.append(new_file)
 
 
-def process_folder(folder: Path, level: int) -> bool:
+def process_folder(folder: Path, level: int, plan: SortPlan) -> bool:
     print(folder)
+    start = perf_counter()
+    subfolders_time = 0.0
     delete_flag = bool(level)
-    for x in folder.iterdir():
-        if x.is_dir():
-            if level or x.suffix or not x.stem.lower() in FOLDERS:
-                delete_flag &= process_folder(x, level + 1)
+    unknown = []
+    for x in plan.iterdir(folder):
+        if not level and x.name.startswith((JOURNAL, CHECKPOINT)):
+            continue
+        if plan.is_dir(x):
+            if not is_sort_folder(x, level, plan.rules):
+                subfolder_start = perf_counter()
+                delete_flag &= process_folder(x, level + 1, plan)
+                subfolders_time += perf_counter() - subfolder_start
+        elif category := plan.rules.get_category(x):
+            process_file(x, plan.folder / category, plan)
         else:
-            for name, ext in FOLDERS.items():
-                if x.suffix[1:].upper() in ext:
-                    process_file(x, x.parents[level] / name)
-                    break
+            unknown.append(x)
+    # unlisted extensions: look at the file contents (if enabled)
+    for x, category in zip(unknown, sniff_files(unknown, plan.rules)):
+        if category:
+            process_file(x, plan.folder / category, plan, unpack=False)
+        else:
+            # unlisted extention = do not move the file
+            # mark folder as "not empty"
+            delete_flag = False
+            # normalize file name
+            s = normalize(x.stem)
+            if s != x.stem:
+                new_file = get_unique_name(x, s, plan)
+                plan.add("rename", x, new_file, UNKNOWN_EXT)
             else:
-                # unlisted extention = do not move the file
-                counters[2] += 1
-                # mark folder as "not empty"
-                delete_flag = False
-                # normalize file name
-                s = normalize(x.stem)
-                if s != x.stem:
-                    x.rename(get_unique_name(x, s))
+                plan.add("keep", x, reason=UNKNOWN_EXT)
     if delete_flag:
         # delete empty folder
-        folder.rmdir()
-        counters[3] += 1
-    else:
+        plan.add("rmdir", folder, reason=EMPTY_FOLDER)
+    elif level:
         # normalize folder name
         s = normalize(folder.stem)
         if s != folder.stem:
-            folder.rename(get_unique_name(folder, s))
+            new_folder = get_unique_name(folder, s, plan)
+            plan.add("rename", folder, new_folder, NORMALIZE)
+    plan.report.folder_times[folder] = (
+        perf_counter() - start - subfolders_time
+    )
     return delete_flag
 
 
-def sort_files(folder: Path):
-    # check the target folder
+def plan_archives(plan: SortPlan):
+    # archives are unpacked once all the files are in place
+    for archive in plan.archives:
+        plan.add("unpack", archive, archive.parent / archive.stem, ARCHIVE)
+
+
+def plan_sort(
+    folder: Path, algorithm: str = HASH_ALGORITHM, rules=None, report=None
+) -> SortPlan:
+    plan = SortPlan(folder, algorithm, rules, report)
+    start = perf_counter()
+    process_folder(folder, 0, plan)
+    plan_archives(plan)
+    plan.report.plan_time += perf_counter() - start
+    return plan
+
+
+def copy_data(src, dst, size: int) -> str:
+    # the method that worked: copy in the kernel (copy_file_range,
+    # sendfile) or through user space
+    if copy_file_range and size:
+        try:
+            copied = 0
+            while copied < size:
+                n = copy_file_range(src.fileno(), dst.fileno(), COPY_CHUNK)
+                if not n:
+                    break
+                copied += n
+            if copied == size:
+                return "copy_file_range"
+        except OSError:
+            pass
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+    if sendfile and size:
+        try:
+            copied = 0
+            while copied < size:
+                n = sendfile(dst.fileno(), src.fileno(), copied, COPY_CHUNK)
+                if not n:
+                    break
+                copied += n
+            if copied == size:
+                dst.seek(copied)
+                return "sendfile"
+        except OSError:
+            pass
+        src.seek(0)
+        dst.seek(0)
+        dst.truncate()
+    copyfileobj(src, dst, COPY_CHUNK)
+    return "copy"
+
+
+def move_file(source: Path, destination: Path, report: SortReport):
+    # a rename, or a copy and delete when the destination is on another
+    # file system (a mount point in the sorted folder); the copy is made
+    # under a temporary name, so a crash leaves the source as it was
+    try:
+        replace(source, destination)
+        return
+    except OSError as e:
+        if e.errno != EXDEV:
+            raise
+    start = perf_counter()
+    if source.is_dir():
+        move(str(source), str(destination))
+        method = "copy"
+        size = 0
+    else:
+        fd, tmp = mkstemp(dir=destination.parent, prefix=".sort-", suffix=".tmp")
+        try:
+            with open(source, "rb") as src, open(fd, "wb") as dst:
+                size = fstat(src.fileno()).st_size
+                method = copy_data(src, dst, size)
+                dst.flush()
+                fsync(dst.fileno())
+            copystat(source, tmp)
+            replace(tmp, destination)
+        except BaseException:
+            Path(tmp).unlink(missing_ok=True)
+            raise
+        source.unlink()
+    report.copies[method] = report.copies.get(method, 0) + 1
+    report.bytes_copied += size
+    report.copy_time += perf_counter() - start
+
+
+def apply_step(step: Step, report: SortReport) -> bool:
+    # every step may be applied again after a crash, so it has to
+    # recognize its own result and leave it as it is
+    action, source, destination, reason = step
+    report.fs_calls += 1
+    if action == "mkdir":
+        if not source.is_dir():
+            report.fs_calls += 1
+            source.mkdir()
+            print(f"Folder '{source}' has been created.")
+    elif action in ("move", "rename"):
+        # the files are moved, only the folders being normalized are
+        # renamed: a folder in place of a moved file (MAKE_ROOM) or a taken
+        # destination is the result of an earlier run of the step
+        planned = source.is_dir() if reason == NORMALIZE else source.is_file()
+        if planned and not destination.exists():
+            start = perf_counter()
+            report.fs_calls += 1
+            move_file(source, destination, report)
+            report.move_time += perf_counter() - start
+            if reason == DISPLACED:
+                print(
+                    f"Warning: the file '{destination.parent}'"
+                    + " was moved into that folder."
+                )
+    elif action == "delete":
+        source.unlink(missing_ok=True)
+    elif action == "rmdir":
+        if source.is_dir():
+            report.fs_calls += 1
+            source.rmdir()
+    elif action == "unpack" and source.exists():
+        try:
+            unpack_archive(source, destination)
+        except ReadError:
+            print(f'Warning: could not unpack the file "{source}".')
+            return False
+        else:
+            source.unlink()
+    return True
+
+
+def write_journal(folder: Path, steps: list[Step]):
+    # paths are kept relative to the folder to resume from any directory
+    rows = [
+        (
+            action,
+            str(source.relative_to(folder)),
+            str(destination.relative_to(folder)) if destination else None,
+            reason,
+        )
+        for action, source, destination, reason in steps
+    ]
+    # a journal cut off by a crash would stop every next sort
+    tmp = folder / (JOURNAL + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(dumps(rows) + "\n")
+        f.flush()
+        fsync(f.fileno())
+    replace(tmp, folder / JOURNAL)
+
+
+def read_journal(folder: Path) -> tuple[list[Step], int]:
+    with open(folder / JOURNAL, "r", encoding="utf-8") as f:
+        steps = [
+            Step(
+                action,
+                folder / source,
+                folder / destination if destination else None,
+                reason,
+            )
+            for action, source, destination, reason in loads(f.readline())
+        ]
+        # every next line is the number of applied steps
+        # (the last one may be cut off by a crash)
+        done = 0
+        for line in f:
+            if line.strip().isdigit():
+                done = int(line)
+    return steps, done
+
+
+def execute_plan(
+    folder: Path, steps: list[Step], report: SortReport, done: int = 0
+):
+    execute_start = perf_counter()
+    with open(folder / JOURNAL, "a", encoding="utf-8") as f:
+        for start in range(done, len(steps), BATCH_SIZE):
+            batch = steps[start:start + BATCH_SIZE]
+            for step in batch:
+                if apply_step(step, report):
+                    report.count(step)
+            f.write(f"{start + len(batch)}\n")
+            f.flush()
+            fsync(f.fileno())
+    (folder / JOURNAL).unlink()
+    report.execute_time += perf_counter() - execute_start
+
+
+def print_plan(steps: list[Step]):
+    for action, source, destination, reason in steps:
+        if destination:
+            print(f"{action:<6} '{source}' -> '{destination}' ({reason})")
+        else:
+            print(f"{action:<6} '{source}' ({reason})")
+
+
+def check_folder(folder: Path):
     if not folder.exists():
         raise ValueError(f"ERROR: '{folder}' does not exist.")
     if not folder.is_dir():
         raise ValueError(f"ERROR: '{folder}' is a file (not a folder).")
-    # main procedure
-    print(f"Processing folder '{folder.parent.resolve()}'...")
-    process_folder(folder, 0)
-    # process archives
-    for archive in archives:
+
+
+def sort_files(
+    folder: Path,
+    dry_run: bool = False,
+    algorithm: str = HASH_ALGORITHM,
+    rules=None,
+) -> SortReport:
+    # check the target folder
+    check_folder(folder)
+    rules = rules or load_rules()
+    report = SortReport(folder)
+    # resume an interrupted sort or plan a new one
+    resume = (folder / JOURNAL).exists()
+    if resume:
+        steps, done = read_journal(folder)
+        print(
+            f"Resuming the interrupted sort of '{folder.resolve()}'"
+            + f" ({len(steps) - done} of {len(steps)} steps left)..."
+        )
+    else:
+        print(f"Processing folder '{folder.parent.resolve()}'...")
+        steps, done = plan_sort(folder, algorithm, rules, report).steps, 0
+    if dry_run:
+        print("\nDry run, nothing has been changed. Planned steps:")
+        print_plan(steps[done:])
+        for step in steps[done:]:
+            report.count(step)
+        print()
+    else:
+        if not resume:
+            write_journal(folder, steps)
+        execute_plan(folder, steps, report, done)
+    # print counters
+    print(report)
+    return report
+
+
+def read_checkpoint(folder: Path) -> dict:
+    if (folder / CHECKPOINT).exists():
+        with open(folder / CHECKPOINT, "r", encoding="utf-8") as f:
+            return loads(f.read())
+    return {"dirs": {}}
+
+
+def write_checkpoint(folder: Path, state: dict):
+    tmp = folder / (CHECKPOINT + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(dumps(state))
+        f.flush()
+        fsync(f.fileno())
+    replace(tmp, folder / CHECKPOINT)
+
+
+def scan_folder(folder: Path, key: str, state: dict, plan: SortPlan) -> list:
+    # plans new or modified files of one folder, returns new subfolders
+    d = folder / key
+    known = state["dirs"].get(key, {}).get("files", {})
+    files = {}
+    subfolders = []
+    unknown = []
+    settled = True
+    mtime = d.stat().st_mtime_ns
+    for x in plan.iterdir(d):
+        if d == folder and x.name.startswith((JOURNAL, CHECKPOINT)):
+            continue
+        if x.is_dir():
+            x_key = str(x.relative_to(folder))
+            level = int(d != folder)
+            if x_key not in state["dirs"] and not is_sort_folder(
+                x, level, plan.rules
+            ):
+                subfolders.append(x_key)
+            continue
+        st = x.stat()
+        stamp = [st.st_mtime_ns, st.st_size]
+        if known.get(x.name) == stamp:
+            files[x.name] = stamp
+        elif time() - st.st_mtime < SETTLE_TIME:
+            # look at the folder again on the next cycle
+            settled = False
+        elif category := plan.rules.get_category(x):
+            process_file(x, folder / category, plan)
+        else:
+            unknown.append((x, stamp))
+    for (x, stamp), category in zip(
+        unknown, sniff_files([x for x, _ in unknown], plan.rules)
+    ):
+        if category:
+            process_file(x, folder / category, plan, unpack=False)
+        else:
+            s = normalize(x.stem)
+            if s != x.stem:
+                new_file = get_unique_name(x, s, plan)
+                plan.add("rename", x, new_file, UNKNOWN_EXT)
+                files[new_file.name] = stamp
+            else:
+                plan.add("keep", x, reason=UNKNOWN_EXT)
+                files[x.name] = stamp
+    # the mtime is taken before listing, so files that come in meanwhile
+    # change it and get the folder listed again
+    state["dirs"][key] = {"mtime": mtime if settled else None, "files": files}
+    return subfolders
+
+
+def watch_cycle(
+    folder: Path, state: dict, algorithm=HASH_ALGORITHM, rules=None
+):
+    # only the folders with a changed mtime are listed again
+    plan = SortPlan(folder, algorithm, rules)
+    start = perf_counter()
+    changed = []
+    for key, entry in list(state["dirs"].items()):
         try:
-            unpack_archive(archive, folder / "archives" / archive.stem)
-        except ReadError:
-            print(f'Warning: could not unpack the file "{archive}".')
-            archives.remove(archive)
+            mtime = (folder / key).stat().st_mtime_ns
+        except FileNotFoundError:
+            del state["dirs"][key]
         else:
-            archive.unlink()
-    # print counters
-    b = bool(sum(counters)) or bool(len(archives))
-    for f, n in total.items():
-        if n and f != "archives":
-            b = True
-            print('{} file{} moved to the folder "{}".'.format(*plural(n), f))
-    if len(archives):
-        print("{} archive{} unpacked.".format(*plural(len(archives))))
-    if counters[0]:
-        print("{} file{} renamed (duplicate name).".format(*plural(counters[0])))
-    if counters[1]:
-        print("{} duplicate file{} deleted.".format(*plural(counters[1])))
-    if counters[3]:
-        print("{} empty folder{} deleted.".format(*plural(counters[3])))
-    if counters[2]:
-        print("{} file{} not moved (check extension).".format(*plural(counters[2])))
-    elif not b:
-        print("0 files found to process.")
+            if mtime != entry["mtime"]:
+                changed.append(key)
+    if not state["dirs"]:
+        changed.append(str(Path(".")))
+    while changed:
+        changed.extend(scan_folder(folder, changed.pop(), state, plan))
+    plan_archives(plan)
+    plan.report.plan_time += perf_counter() - start
+    return plan
+
+
+def watch_folder(
+    folder: Path,
+    interval: float = WATCH_INTERVAL,
+    algorithm: str = HASH_ALGORITHM,
+    rules=None,
+):
+    check_folder(folder)
+    rules = rules or load_rules()
+    # finish an interrupted sort first
+    if (folder / JOURNAL).exists():
+        sort_files(folder, algorithm=algorithm, rules=rules)
+    state = read_checkpoint(folder)
+    print(f"Watching folder '{folder.resolve()}' (Ctrl+C to stop)...")
+    try:
+        while True:
+            plan = watch_cycle(folder, state, algorithm, rules)
+            if any(step.action != "keep" for step in plan.steps):
+                write_journal(folder, plan.steps)
+                execute_plan(folder, plan.steps, plan.report)
+                print(plan.report)
+            write_checkpoint(folder, state)
+            sleep(interval)
+    except KeyboardInterrupt:
+        print("\nWatching stopped.")
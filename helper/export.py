@@ -0,0 +1,155 @@
+import csv
+import json
+from sys import stdout
+from classes import AddressBook, NoteBook, DATE_FORMAT, WRITE_BUFFER
+from snapshot import Mapped
+
+# vCard lines longer than this (in octets) are folded
+VCARD_LINE = 75
+CSV_HEADER = ("name", "birthday", "email", "phone")
+
+
+def vcard_escape(text: str) -> str:
+    return (
+        text.replace("\\", "\\\\").replace(",", "\\,")
+        .replace(";", "\\;").replace("\n", "\\n")
+    )
+
+
+def vcard_fold(line: str) -> str:
+    # RFC 6350 3.2: continuation lines start with a space
+    data = line.encode("utf-8")
+    if len(data) <= VCARD_LINE:
+        return line + "\r\n"
+    parts = []
+    start = 0
+    limit = VCARD_LINE
+    while start < len(data):
+        end = min(start + limit, len(data))
+        # do not split a multi-byte character
+        while end < len(data) and data[end] & 0xC0 == 0x80:
+            end -= 1
+        parts.append(data[start:end].decode("utf-8"))
+        start = end
+        limit = VCARD_LINE - 1
+    return "\r\n ".join(parts) + "\r\n"
+
+
+def vcard(f, records) -> int:
+    count = 0
+    for record in records:
+        lines = [
+            "BEGIN:VCARD",
+            "VERSION:4.0",
+            "FN:" + vcard_escape(record.name.value),
+        ]
+        if record.birthday:
+            lines.append("BDAY:" + record.birthday.value.strftime("%Y%m%d"))
+        if record.email:
+            lines.append("EMAIL:" + vcard_escape(record.email.value))
+        for phone in record.phone:
+            lines.append(f"TEL;VALUE=uri:tel:+{phone.value}")
+        lines.append("END:VCARD")
+        f.write("".join(vcard_fold(line) for line in lines))
+        count += 1
+    return count
+
+
+def csv_contacts(f, records) -> int:
+    writer = csv.writer(f)
+    writer.writerow(CSV_HEADER)
+    count = 0
+    for record in records:
+        writer.writerow((
+            record.name.value,
+            record.birthday.value.strftime(DATE_FORMAT)
+            if record.birthday else "",
+            record.email.value if record.email else "",
+            " ".join(p.value for p in record.phone),
+        ))
+        count += 1
+    return count
+
+
+def markdown(f, notes) -> int:
+    count = 0
+    for note_id, note in notes:
+        f.write(f"## Note {note_id} ({note['created']})\n\n{note['text']}\n\n")
+        if note["tags"]:
+            f.write(" ".join(f"`{tag}`" for tag in note["tags"]) + "\n\n")
+        count += 1
+    return count
+
+
+def jsonl(f, notes) -> int:
+    count = 0
+    for note_id, note in notes:
+        f.write(json.dumps({
+            "id": note_id,
+            "created": note["created"],
+            "text": note["text"],
+            "tags": note["tags"],
+        }, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+
+# format -> (book, writer)
+EXPORT_FORMATS = {
+    "vcard": ("contacts", vcard),
+    "csv": ("contacts", csv_contacts),
+    "markdown": ("notes", markdown),
+    "jsonl": ("notes", jsonl),
+}
+
+
+def export_items(kind: str, book, keys=None):
+    # one entry at a time, keys are the result of a search_* call; the
+    # entries still in the snapshot are made for the export only, not kept
+    if keys is None:
+        items = book.data_items()
+    else:
+        items = ((key, book.data_ref(key)) for key in keys)
+    for key, value in items:
+        if kind == "contacts":
+            if isinstance(value, Mapped):
+                value = book.load_record(value.index)
+            yield value
+        else:
+            if isinstance(value, Mapped):
+                value = book.snapshot_entry(value.index)
+            yield key, value
+
+
+def export(
+    fmt: str, file_name: str, contacts: AddressBook, notes: NoteBook,
+    keys=None,
+) -> int:
+    # the number of exported contacts/notes, file_name "-" is stdout
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(
+            f"ERROR: unknown format '{fmt}'"
+            + f" (expected {', '.join(EXPORT_FORMATS)})"
+        )
+    kind, writer = EXPORT_FORMATS[fmt]
+    items = export_items(
+        kind, contacts if kind == "contacts" else notes, keys
+    )
+    if file_name == "-":
+        return writer(stdout, items)
+    with open(
+        file_name, "w", encoding="utf-8", newline="", buffering=WRITE_BUFFER
+    ) as f:
+        return writer(f, items)
+
+
+def search_keys(kind: str, contacts, notes, pattern: str):
+    # the same search as the menu: e-mail for '@...', else everything
+    if not pattern:
+        return None
+    if kind == "notes":
+        # search_tag gives None when no note is untagged
+        return notes.search_all(pattern) or []
+    if "@" in pattern:
+        return contacts.search_email(pattern)
+    return contacts.search_all(pattern)
@@ -0,0 +1,32 @@
+from pathlib import Path
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def lock_path(file_path: Path) -> Path:
+    # the data files are replaced on every save, the lock file stays
+    return file_path.with_name(file_path.name + ".lock")
+
+
+@contextmanager
+def locked(file_path: Path, shared: bool = False):
+    # advisory lock of a data file between bot-helper sessions
+    with open(lock_path(file_path), "a+b") as f:
+        if fcntl:
+            fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,93 @@
+import json
+
+# characters read from the file at a time while parsing
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\n\r"
+decoder = json.JSONDecoder()
+encode = json.JSONEncoder().encode
+
+
+def dump_entries(f, entries):
+    # writes the (key, value) pairs as one JSON object, entry by entry;
+    # the output is the same as json.dump() of the whole dict
+    f.write("{")
+    separator = ""
+    for key, value in entries:
+        f.write(separator + encode(str(key)) + ": " + encode(value))
+        separator = ", "
+    f.write("}")
+
+
+class EntryReader:
+    # a window over the file, only the entry being parsed is kept in memory
+    def __init__(self, f, chunk_size: int = CHUNK_SIZE):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def error(self, message: str):
+        return json.JSONDecodeError(message, self.buffer, self.pos)
+
+    def next_char(self) -> str:
+        # the next non-whitespace character, not consumed ("" at the end)
+        while True:
+            while self.pos < len(self.buffer):
+                if self.buffer[self.pos] not in WHITESPACE:
+                    return self.buffer[self.pos]
+                self.pos += 1
+            if not self.fill():
+                return ""
+
+    def expect(self, chars: str) -> str:
+        char = self.next_char()
+        if not char or char not in chars:
+            raise self.error(f"Expecting one of '{chars}'")
+        self.pos += 1
+        return char
+
+    def value(self):
+        while True:
+            self.next_char()
+            try:
+                value, end = decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            # a number may go on in the next chunk
+            if end == len(self.buffer) and self.fill():
+                continue
+            self.pos = end
+            return value
+
+
+def load_entries(f, chunk_size: int = CHUNK_SIZE):
+    # yields the (key, value) pairs of the top level JSON object one by one
+    reader = EntryReader(f, chunk_size)
+    reader.expect("{")
+    if reader.next_char() == "}":
+        reader.pos += 1
+    else:
+        while True:
+            key = reader.value()
+            if not isinstance(key, str):
+                raise reader.error("Expecting property name")
+            reader.expect(":")
+            yield key, reader.value()
+            if reader.expect(",}") == "}":
+                break
+    if reader.next_char():
+        raise reader.error("Extra data")
@@ -0,0 +1,165 @@
+import os
+import re
+import atexit
+from array import array
+from bisect import bisect_right
+from heapq import merge
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+
+# records between the columns entries, a query never contains it
+SEPARATOR = b"\0"
+# the columns are rebuilt when this part of the records has changed
+REFRESH_RATIO = 0.05
+# do not bother the pool with small slices
+MIN_SLICE = 50_000
+# worker side: shared memory name -> SharedMemory
+attached: dict = {}
+
+
+def attach(name: str) -> memoryview:
+    if name not in attached:
+        # the columns of an older snapshot are not needed any more
+        for old in list(attached):
+            attached.pop(old).close()
+        attached[name] = SharedMemory(name)
+    return attached[name].buf
+
+
+def scan_column(buf, layout, query: bytes, start: int, end: int) -> list:
+    data_pos, offsets_pos, count = layout
+    offsets = buf[offsets_pos:offsets_pos + 8 * (count + 1)].cast("q")
+    pattern = re.compile(re.escape(query))
+    found = []
+    pos = offsets[start]
+    stop = offsets[end]
+    while True:
+        match = pattern.search(buf, data_pos + pos, data_pos + stop)
+        if not match:
+            break
+        i = bisect_right(offsets, match.start() - data_pos) - 1
+        found.append(i)
+        # one hit per record is enough
+        pos = offsets[i + 1]
+    offsets.release()
+    return found
+
+
+def scan_buffer(buf, columns: tuple, queries: tuple, start: int, end: int):
+    # indexes of the matching records in the slice
+    found = set()
+    for layout, query in zip(columns, queries):
+        if query:
+            found.update(scan_column(buf, layout, query, start, end))
+    return sorted(found)
+
+
+def scan(name: str, columns: tuple, queries: tuple, start: int, end: int):
+    # runs in a pool process
+    return scan_buffer(attach(name), columns, queries, start, end)
+
+
+def pack_column(values: list[bytes]) -> tuple[bytes, bytes]:
+    # the values one after another and the offsets where each one starts
+    offsets = array("q", [0])
+    for value in values:
+        offsets.append(offsets[-1] + len(value) + 1)
+    return SEPARATOR.join(values) + SEPARATOR, offsets.tobytes()
+
+
+class ParallelSearch:
+    # search_all of an AddressBook on several processes: the lower case
+    # names and the joined phones of all the records are put into shared
+    # memory once (sorted by name) and every process scans its own slice;
+    # the records changed since are checked here until the next rebuild
+    def __init__(self, book, workers: int = None):
+        self.book = book
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.shm = None
+        self.names: list[str] = []
+        self.columns = ()
+        self.touched: set = set()
+        atexit.register(self.close)
+
+    def touch(self, name: str):
+        self.touched.add(name)
+
+    def refresh(self):
+        self.names = sorted(self.book.data)
+        records = [self.book.data[name] for name in self.names]
+        name_data, name_offsets = pack_column(
+            [name.lower().encode("utf-8") for name in self.names]
+        )
+        phone_data, phone_offsets = pack_column(
+            ["!".join(p.value for p in r.phone).encode() for r in records]
+        )
+        parts = (name_data, name_offsets, phone_data, phone_offsets)
+        shm = SharedMemory(create=True, size=max(1, sum(map(len, parts))))
+        pos = 0
+        layout = []
+        for part in parts:
+            shm.buf[pos:pos + len(part)] = part
+            layout.append(pos)
+            pos += len(part)
+        count = len(self.names)
+        self.columns = (
+            (layout[0], layout[1], count),
+            (layout[2], layout[3], count),
+        )
+        self.close_shm()
+        self.shm = shm
+        self.touched = set()
+
+    def search_all(self, search_str: str) -> list[str]:
+        if self.shm is None or \
+                len(self.touched) > REFRESH_RATIO * max(len(self.names), 1):
+            self.refresh()
+        queries = (
+            search_str.lower().encode("utf-8"),
+            search_str.encode() if search_str.isdigit() else b"",
+        )
+        if SEPARATOR in queries[0]:
+            return []
+        count = len(self.names)
+        slices = max(1, min(self.workers, count // MIN_SLICE))
+        bounds = [count * i // slices for i in range(slices + 1)]
+        if slices == 1:
+            found = scan_buffer(self.shm.buf, self.columns, queries, 0, count)
+        else:
+            if not self.pool:
+                # spawn, as for the shards (BookFile.load_file): the bot
+                # runs the autosave and book loading threads
+                self.pool = ProcessPoolExecutor(
+                    self.workers, mp_context=get_context("spawn")
+                )
+            futures = [
+                self.pool.submit(
+                    scan, self.shm.name, self.columns, queries, start, end
+                )
+                for start, end in zip(bounds, bounds[1:])
+            ]
+            # the slices are in name order, so are their results
+            found = [i for future in futures for i in future.result()]
+        touched = self.touched
+        data = self.book.data
+        return list(merge(
+            (self.names[i] for i in found if self.names[i] not in touched),
+            sorted(
+                name for name in touched
+                if name in data and search_str in data[name]
+            ),
+        ))
+
+    def close_shm(self):
+        if self.shm:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        if self.pool:
+            self.pool.shutdown()
+            self.pool = None
+        self.close_shm()
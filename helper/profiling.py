@@ -0,0 +1,140 @@
+import os
+import sys
+import json
+import atexit
+import cProfile
+import pstats
+import tracemalloc
+from time import perf_counter
+from functools import wraps
+from threading import Lock, local
+from contextlib import contextmanager
+
+# BOT_HELPER_PROFILE=time,cprofile,memory or --profile[=time,cprofile,memory]
+PROFILE_ENV = "BOT_HELPER_PROFILE"
+PROFILE_FLAG = "--profile"
+PROFILE_MODES = ("time", "cprofile", "memory")
+# output files: <prefix>.json, <prefix>.prof, <prefix>-<action>.prof
+PROFILE_PREFIX = "bot-helper-profile"
+
+
+class Profiler:
+    def __init__(self, modes=("time",), prefix: str = PROFILE_PREFIX):
+        self.modes = set(modes)
+        self.prefix = prefix
+        # name -> {"calls", "total", "max", "peak"}
+        self.stats: dict = {}
+        # action name -> cProfile.Profile
+        self.profiles: dict = {}
+        self.lock = Lock()
+        # per thread stack of the time to exclude (waiting for input)
+        self.local = local()
+        if "memory" in self.modes:
+            tracemalloc.start()
+
+    def stack(self) -> list:
+        if not hasattr(self.local, "stack"):
+            self.local.stack = []
+        return self.local.stack
+
+    def measure(self, name: str, func, *args, profile=False, **kwargs):
+        stack = self.stack()
+        top = not stack
+        stack.append(0.0)
+        profiler = None
+        if profile and top and "cprofile" in self.modes:
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        memory = top and "memory" in self.modes
+        if memory:
+            tracemalloc.reset_peak()
+            start_memory = tracemalloc.get_traced_memory()[0]
+        start = perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = perf_counter() - start - stack.pop()
+            if profiler:
+                profiler.disable()
+            peak = tracemalloc.get_traced_memory()[1] - start_memory \
+                if memory else 0
+            with self.lock:
+                entry = self.stats.setdefault(
+                    name, {"calls": 0, "total": 0.0, "max": 0.0, "peak": 0}
+                )
+                entry["calls"] += 1
+                entry["total"] += elapsed
+                entry["max"] = max(entry["max"], elapsed)
+                entry["peak"] = max(entry["peak"], peak)
+
+    @contextmanager
+    def paused(self):
+        # the time spent here is not counted for the enclosing measurements
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            stack = self.stack()
+            for i in range(len(stack)):
+                stack[i] += elapsed
+
+    def wrap(self, name: str, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.measure(name, func, *args, **kwargs)
+        return wrapper
+
+    def instrument(self, cls, methods: tuple):
+        for method in methods:
+            name = f"{cls.__name__}.{method}"
+            setattr(cls, method, self.wrap(name, getattr(cls, method)))
+
+    def summary(self) -> str:
+        lines = [
+            f"{'Action':<34} {'calls':>7} {'total, ms':>11} {'mean, ms':>10}"
+            + f" {'max, ms':>10} {'peak, KiB':>10}",
+            "-" * 34 + " " + "-" * 7 + " " + "-" * 11 + " " + "-" * 10
+            + " " + "-" * 10 + " " + "-" * 10,
+        ]
+        for name, entry in sorted(
+            self.stats.items(), key=lambda x: x[1]["total"], reverse=True
+        ):
+            lines.append(
+                f"{name:<34} {entry['calls']:>7}"
+                + f" {entry['total'] * 1000:>11.3f}"
+                + f" {entry['total'] / entry['calls'] * 1000:>10.3f}"
+                + f" {entry['max'] * 1000:>10.3f}"
+                + f" {entry['peak'] // 1024 if entry['peak'] else '':>10}"
+            )
+        return "\n".join(lines)
+
+    def dump(self):
+        with open(self.prefix + ".json", "w", encoding="utf-8") as f:
+            json.dump(self.stats, f, indent=2)
+        files = []
+        for name, profile in self.profiles.items():
+            file_name = f"{self.prefix}-{name}.prof"
+            profile.dump_stats(file_name)
+            files.append(file_name)
+        if files:
+            # all the actions together (pstats / snakeviz / gprof2dot)
+            pstats.Stats(*files).dump_stats(self.prefix + ".prof")
+        print("\n" + self.summary(), file=sys.stderr)
+        print(f"Profile saved to {self.prefix}.*", file=sys.stderr)
+
+
+def get_profiler(args: list[str]):
+    # None unless profiling is asked for by the environment or the flag
+    modes = os.environ.get(PROFILE_ENV)
+    for arg in args:
+        if arg == PROFILE_FLAG:
+            modes = modes or "time"
+        elif arg.startswith(PROFILE_FLAG + "="):
+            modes = arg.partition("=")[2]
+    if not modes:
+        return None
+    modes = [m.strip() for m in modes.split(",") if m.strip() in PROFILE_MODES]
+    profiler = Profiler(modes or ("time",))
+    atexit.register(profiler.dump)
+    return profiler
@@ -0,0 +1,235 @@
+import struct
+from bisect import bisect_left
+from collections import namedtuple
+from collections.abc import MutableMapping
+from mmap import mmap, ACCESS_READ
+from parallel import SEPARATOR, pack_column, scan_column
+
+# <file>.snap: a binary copy of a book, written with the data file and
+# read through mmap, so a session starts without parsing the JSON and the
+# pages are shared by all the sessions:
+#   header, column table (offsets position, data position) per column,
+#   fixed-width records (number key, entry hash, date as an ordinal),
+#   per column: count + 1 offsets and the "\0" terminated UTF-8 values
+MAGIC = b"BHSNAP01"
+HEADER = struct.Struct("<8sIqqqI")
+COLUMN = struct.Struct("<qq")
+RECORD = struct.Struct("<qIi")
+# the keys are the values of the first column or the numbers of the records
+TEXT_KEYS = 0
+NUMBER_KEYS = 1
+ALIGN = 8
+
+# an entry still in the snapshot (see SnapshotData.refs)
+Mapped = namedtuple("Mapped", "index")
+
+
+def align(pos: int) -> int:
+    return -(-pos // ALIGN) * ALIGN
+
+
+def dump_snapshot(
+    f, key_type: int, version: int, records: list, columns: list
+):
+    # records: (number, hash, date) tuples, columns: lists of str values,
+    # both in the order of the keys
+    count = len(records)
+    packed = []
+    for values in columns:
+        data, offsets = pack_column([v.encode("utf-8") for v in values])
+        if data.count(SEPARATOR) != count:
+            raise ValueError("ERROR: a snapshot value contains '\\0'")
+        packed.append((offsets, data))
+    pos = align(HEADER.size + COLUMN.size * len(columns))
+    records_pos = pos
+    pos = align(pos + RECORD.size * count)
+    table = []
+    for offsets, data in packed:
+        table.append((pos, pos + len(offsets)))
+        pos = align(pos + len(offsets) + len(data))
+    f.write(HEADER.pack(MAGIC, key_type, version, count, pos, len(columns)))
+    for offsets_pos, data_pos in table:
+        f.write(COLUMN.pack(offsets_pos, data_pos))
+    written = HEADER.size + COLUMN.size * len(columns)
+    f.write(bytes(records_pos - written))
+    f.write(b"".join(RECORD.pack(*record) for record in records))
+    written = records_pos + RECORD.size * count
+    for (offsets, data), (offsets_pos, _) in zip(packed, table):
+        f.write(bytes(offsets_pos - written))
+        f.write(offsets)
+        f.write(data)
+        written = offsets_pos + len(offsets) + len(data)
+    f.write(bytes(pos - written))
+
+
+class Snapshot:
+    def __init__(self, file_path):
+        with open(file_path, "rb") as f:
+            self.map = mmap(f.fileno(), 0, access=ACCESS_READ)
+        self.buf = memoryview(self.map)
+        (
+            magic, self.key_type, self.version, self.count, size, columns
+        ) = HEADER.unpack_from(self.buf)
+        if magic != MAGIC or size != len(self.buf):
+            raise ValueError(f"ERROR: '{file_path}' is not a valid snapshot")
+        self.columns = [
+            COLUMN.unpack_from(self.buf, HEADER.size + COLUMN.size * i)
+            for i in range(columns)
+        ]
+        self.records_pos = align(HEADER.size + COLUMN.size * columns)
+        self.offsets = [
+            self.buf[pos:pos + 8 * (self.count + 1)].cast("q")
+            for pos, _ in self.columns
+        ]
+
+    def record(self, i: int) -> tuple:
+        return RECORD.unpack_from(self.buf, self.records_pos + RECORD.size * i)
+
+    def raw(self, column: int, i: int) -> bytes:
+        offsets = self.offsets[column]
+        pos = self.columns[column][1]
+        return bytes(self.buf[pos + offsets[i]:pos + offsets[i + 1] - 1])
+
+    def value(self, column: int, i: int) -> str:
+        return self.raw(column, i).decode("utf-8")
+
+    def key(self, i: int):
+        if self.key_type == NUMBER_KEYS:
+            return self.record(i)[0]
+        return self.value(0, i)
+
+    def find(self, key):
+        # the index of the key (a binary search), None if it is not there
+        if self.key_type == NUMBER_KEYS:
+            if isinstance(key, str):
+                if not key.isdigit():
+                    return None
+                key = int(key)
+            elif not isinstance(key, int):
+                return None
+            i = bisect_left(
+                range(self.count), key, key=lambda i: self.record(i)[0]
+            )
+            found = i < self.count and self.record(i)[0] == key
+        else:
+            if not isinstance(key, str):
+                return None
+            key = key.encode("utf-8")
+            i = bisect_left(range(self.count), key, key=lambda i: self.raw(0, i))
+            found = i < self.count and self.raw(0, i) == key
+        return i if found else None
+
+    def scan(self, column: int, query: bytes) -> list:
+        # indexes of the records whose value contains the query
+        offsets_pos, data_pos = self.columns[column]
+        return scan_column(
+            self.buf, (data_pos, offsets_pos, self.count), query, 0, self.count
+        )
+
+
+class SnapshotData(MutableMapping):
+    # the data dict of a book read from a snapshot: an entry is made by
+    # load(index) on first access and kept, the snapshot entries deleted
+    # or replaced since are in removed; key converts the snapshot keys
+    def __init__(self, snapshot: Snapshot, load, key=None):
+        self.snapshot = snapshot
+        self.load = load
+        self.convert = key
+        self.cache: dict = {}
+        self.removed: set = set()
+        self.count = snapshot.count
+
+    def key(self, i: int):
+        key = self.snapshot.key(i)
+        return self.convert(key) if self.convert else key
+
+    def find(self, key):
+        if key in self.removed:
+            return None
+        return self.snapshot.find(key)
+
+    def __getitem__(self, key):
+        if key in self.cache:
+            return self.cache[key]
+        i = self.find(key)
+        if i is None:
+            raise KeyError(key)
+        value = self.cache[key] = self.load(i)
+        return value
+
+    def __contains__(self, key) -> bool:
+        return key in self.cache or self.find(key) is not None
+
+    def __setitem__(self, key, value):
+        if key not in self:
+            self.count += 1
+        if self.snapshot.find(key) is not None:
+            self.removed.add(key)
+        self.cache[key] = value
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self.cache.pop(key, None)
+        if self.snapshot.find(key) is not None:
+            self.removed.add(key)
+        self.count -= 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for i in range(self.snapshot.count):
+            key = self.key(i)
+            if key in self.cache or key not in self.removed:
+                yield key
+        # the keys added since
+        for key in list(self.cache):
+            if self.snapshot.find(key) is None:
+                yield key
+
+    def mapped(self, unread: bool = True):
+        # (index, key) of the entries as they are in the snapshot, only the
+        # ones not read yet or all of them that are not deleted or replaced
+        for i in range(self.snapshot.count):
+            key = self.key(i)
+            if key not in self.removed and not (unread and key in self.cache):
+                yield i, key
+
+    def refs(self) -> list:
+        # (key, entry or Mapped) of all the entries, the ones still in the
+        # snapshot are read only when they are written
+        # (taken while the main thread may go on changing the book, the
+        # copies of the dict and the set are made at once)
+        cache = dict(self.cache)
+        removed = set(self.removed)
+        items = []
+        for i in range(self.snapshot.count):
+            key = self.key(i)
+            if key in cache:
+                if key not in removed:
+                    items.append((key, cache[key]))
+            elif key not in removed:
+                items.append((key, Mapped(i)))
+        items.extend(
+            (key, value) for key, value in cache.items()
+            if key in removed or self.snapshot.find(key) is None
+        )
+        return items
+
+    def scan(self, column: int, query: bytes) -> list:
+        # keys of the unread entries whose value contains the query
+        if not query:
+            return [key for _, key in self.mapped()]
+        if SEPARATOR in query:
+            return []
+        return self.unread_keys(self.snapshot.scan(column, query))
+
+    def unread_keys(self, indexes) -> list:
+        # keys of the snapshot entries at the indexes that are not read yet
+        keys = []
+        for i in indexes:
+            key = self.key(i)
+            if key not in self.removed and key not in self.cache:
+                keys.append(key)
+        return keys